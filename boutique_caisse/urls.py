@@ -16,16 +16,36 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from caisse import views
+from caisse import api, views
+from caisse.metriques import metriques
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('django.contrib.auth.urls')),  
     path('', views.accueil, name='accueil'),
     path('caisse/', views.caisse, name='caisse'),  
+    path('api/caisse/ajouter/', api.api_ajouter, name='api_ajouter'),
+    path('api/caisse/retirer/', api.api_retirer, name='api_retirer'),
+    path('api/caisse/remise/', api.api_remise, name='api_remise'),
+    path('api/caisse/payer/', api.api_payer, name='api_payer'),
+    path('api/caisse/tickets/', api.api_tickets, name='api_tickets'),
+    path('api/produits/code/<str:code>/', api.api_produit_code, name='api_produit_code'),
+    path('api/produits/recherche/', api.api_recherche, name='api_recherche'),
+    path('api/produits/stocks/', api.api_stocks, name='api_stocks'),
+    path('api/stock/', api.api_stock_a_date, name='api_stock_a_date'),
     path('importer/', views.importer_produits, name='importer_produits'),
     path('rapports/', views.rapports, name='rapports'),
+    path('rapports/graphique.png', views.rapports_graphique, name='rapports_graphique'),
+    path('rapports/exports/<int:export_id>/', views.export_statut, name='export_statut'),
+    path('rapports/exports/<int:export_id>/fichier/', views.export_fichier, name='export_fichier'),
+    path('rapports/z/cloturer/', views.cloturer_journee, name='cloturer_journee'),
+    path('rapports/z/<str:jour>.pdf', views.rapport_z, name='rapport_z'),
+    path('rapports/tickets/', views.rapports_tickets, name='rapports_tickets'),
+    path('rapports/ventes/', views.rapports_ventes, name='rapports_ventes'),
+    path('rapports/paiements/', views.rapports_paiements, name='rapports_paiements'),
+    path('tickets/<int:ticket_id>/', views.ticket, name='ticket'),
     path('produits-critiques/', views.produits_critiques, name='produits_critiques'),
 path('reassort/<int:produit_id>/', views.reassort_produit, name='reassort_produit'),
 path('reassort-auto/', views.reassort_auto, name='reassort_auto'),
+    path('metrics', metriques, name='metriques'),
 ]
\ No newline at end of file
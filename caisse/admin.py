@@ -1,13 +1,23 @@
 from django.contrib import admin
-from .models import Produit, Vente, Reassort
+from django.db import transaction
+from .models import MouvementStock, Produit, Promotion, Vente, Reassort, Ticket
+from .stock import tracer
 
 
 @admin.register(Produit)
 class ProduitAdmin(admin.ModelAdmin):
-    list_display = ('nom', 'prix', 'stock')  
-    search_fields = ('nom',)  
+    list_display = ('nom', 'code_barre', 'prix', 'stock')  
+    search_fields = ('^nom', '=code_barre')  
     list_filter = ('prix',)  
 
+    def save_model(self, request, obj, form, change):
+        # Toute modification du stock passe par le journal des mouvements
+        ancien = form.initial.get('stock', 0) if change else 0
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            if 'stock' in form.changed_data or not change:
+                tracer([(obj.id, 'ajustement', obj.stock - ancien)])
+
 @admin.register(Vente)
 class VenteAdmin(admin.ModelAdmin):
     list_display = ('produit', 'quantite', 'total', 'date_vente')
@@ -15,6 +25,39 @@ class VenteAdmin(admin.ModelAdmin):
     readonly_fields = ('total',)  
     
     
+@admin.register(Ticket)
+class TicketAdmin(admin.ModelAdmin):
+    list_display = ('id', 'date_ticket', 'nb_articles', 'total', 'total_brut')
+    list_filter = ('date_ticket',)
+    search_fields = ('=id', '=cle')
+
+
+@admin.register(Promotion)
+class PromotionAdmin(admin.ModelAdmin):
+    list_display = ('nom', 'type', 'valeur', 'produit', 'achetes', 'payes', 'debut', 'fin', 'active')
+    list_filter = ('active', 'type')
+    search_fields = ('nom', 'produit__nom')
+    raw_id_fields = ('produit',)
+
+
+@admin.register(MouvementStock)
+class MouvementStockAdmin(admin.ModelAdmin):
+    list_display = ('id_produit', 'produit', 'type', 'quantite', 'date_mouvement')
+    list_filter = ('type', 'date_mouvement')
+    search_fields = ('produit__nom',)
+    raw_id_fields = ('produit',)
+
+    # Journal en ajout seul : consultable, jamais modifié à la main
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Reassort)
 class ReassortAdmin(admin.ModelAdmin):
     list_display = ('produit', 'quantite_ajoutee', 'stock_avant', 'stock_apres', 'date_reassort')
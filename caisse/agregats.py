@@ -0,0 +1,229 @@
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import MODES_PAIEMENT, ClotureJournee, Paiement, Ticket, Vente, VenteJournaliere
+from .versions import VENTES, incrementer_version
+
+MODES = [code for code, _ in MODES_PAIEMENT]
+# Au-delà, le lendemain (et sa conversion en UTC) sortirait des dates représentables
+DERNIER_JOUR = date.max - timedelta(days=2)
+
+
+def debut_semaine(jour):
+    return jour - timedelta(days=jour.weekday())
+
+
+def debut_mois(jour):
+    return jour.replace(day=1)
+
+
+def debut_annee(jour):
+    return jour.replace(month=1, day=1)
+
+
+def ligne_vide(cle, periode):
+    ligne = {cle: periode, 'total': Decimal('0')}
+    for mode in MODES:
+        ligne[mode] = Decimal('0')
+    return ligne
+
+
+def cumuler(jours, cle, debut_periode):
+    periodes = {}
+    for jour in jours:
+        periode = debut_periode(jour['date'])
+        ligne = periodes.get(periode)
+        if ligne is None:
+            ligne = periodes[periode] = ligne_vide(cle, periode)
+        for mode in MODES:
+            ligne[mode] += jour[mode]
+        ligne['total'] += jour['total']
+    return list(periodes.values())
+
+
+def debut_de_journee(jour):
+    return timezone.make_aware(datetime.combine(jour, time.min))
+
+
+def fin_de_journee(jour):
+    """Début du lendemain, borne exclue d'un filtre jusqu'à `jour` inclus (plafonnée à DERNIER_JOUR)."""
+    return debut_de_journee(min(jour, DERNIER_JOUR) + timedelta(days=1))
+
+
+def entre_jours(champ, debut=None, fin=None):
+    """Filtre `champ` sur les jours debut à fin inclus (bornes facultatives).
+
+    Bornes en datetime (et non champ__date) pour que l'index sur le champ serve.
+    """
+    filtres = Q()
+    if debut:
+        filtres &= Q(**{f'{champ}__gte': debut_de_journee(debut)})
+    if fin:
+        filtres &= Q(**{f'{champ}__lt': fin_de_journee(fin)})
+    return filtres
+
+
+def paiements_entre(debut=None, fin=None):
+    return Paiement.objects.filter(entre_jours('date_paiement', debut, fin))
+
+
+def tickets_entre(debut=None, fin=None):
+    return Ticket.objects.filter(entre_jours('date_ticket', debut, fin))
+
+
+def ventes_entre(debut=None, fin=None):
+    """Toutes les lignes vendues sur la période, filtrées et triées par l'index (date_vente, id)."""
+    return Vente.objects.filter(entre_jours('date_vente', debut, fin)).select_related('produit')
+
+
+def stats_tickets(tickets):
+    """Nombre de tickets, panier moyen et articles par ticket, en un seul agrégat sur Ticket."""
+    stats = tickets.aggregate(nb=Count('id'), total=Sum('total'), articles=Sum('nb_articles'))
+    nb = stats['nb']
+    return {
+        'nb': nb,
+        'total': stats['total'] or Decimal('0'),
+        'panier_moyen': (stats['total'] / nb).quantize(Decimal('0.01')) if nb else Decimal('0'),
+        'articles_moyen': round(stats['articles'] / nb, 1) if nb else 0,
+    }
+
+
+def ca_par_jour(paiements):
+    """Un seul GROUP BY jour, avec le détail par mode en agrégation conditionnelle."""
+    sommes = {mode: Sum('montant_paye', filter=Q(mode=mode)) for mode in MODES}
+    lignes = (
+        paiements.order_by()
+        .annotate(date=TruncDate('date_paiement'))
+        .values('date')
+        .annotate(total=Sum('montant_paye'), **sommes)
+        .order_by('date')
+    )
+    jours = []
+    for ligne in lignes:
+        jour = {'date': ligne['date'], 'total': ligne['total'] or Decimal('0')}
+        for mode in MODES:
+            jour[mode] = ligne[mode] or Decimal('0')
+        jours.append(jour)
+    return jours
+
+
+def ca_par_jour_cumule(debut=None, fin=None):
+    """Même résultat que ca_par_jour, lu dans VenteJournaliere (une ligne par jour et par mode)."""
+    lignes = VenteJournaliere.objects.all()
+    if debut:
+        lignes = lignes.filter(jour__gte=debut)
+    if fin:
+        lignes = lignes.filter(jour__lte=fin)
+    jours = {}
+    for jour, mode, montant in lignes.order_by('jour').values_list('jour', 'mode', 'montant'):
+        ligne = jours.get(jour)
+        if ligne is None:
+            ligne = jours[jour] = ligne_vide('date', jour)
+        if mode in MODES:
+            ligne[mode] += montant
+        ligne['total'] += montant
+    return list(jours.values())
+
+
+def agreger_jours(jours):
+    """Construit les totaux semaine/mois/année à partir des lignes journalières."""
+    return {
+        'jours': jours,
+        'semaines': cumuler(jours, 'semaine', debut_semaine),
+        'mois': cumuler(jours, 'mois', debut_mois),
+        'annees': cumuler(jours, 'an', debut_annee),
+    }
+
+
+def agreger_paiements(paiements):
+    return agreger_jours(ca_par_jour(paiements))
+
+
+def total_du_jour(agregats, jour):
+    for ligne in agregats['jours']:
+        if ligne['date'] == jour:
+            return ligne['total']
+    return Decimal('0')
+
+
+def cumuler_ventes_journalieres(paiements):
+    """Ajoute des paiements tout juste créés au cumul journalier.
+
+    À appeler dans la transaction de l'encaissement. nb_tickets compte les
+    tickets distincts réglés avec ce mode. La ligne de version VENTES est
+    verrouillée avant de revérifier les clôtures, comme le fait cloturer :
+    une vente validée après le calcul d'un rapport Z est impossible, elle
+    lève ValueError et sa transaction est annulée.
+    """
+    cumuls = {}
+    for paiement in paiements:
+        cle = (timezone.localdate(paiement.date_paiement), paiement.mode)
+        montant, tickets = cumuls.get(cle, (Decimal('0'), set()))
+        tickets.add(paiement.ticket_id)
+        cumuls[cle] = (montant + paiement.montant_paye, tickets)
+    if not cumuls:
+        return
+    incrementer_version(VENTES)
+    cloture = ClotureJournee.objects.filter(jour__in={jour for jour, _ in cumuls}).values_list('jour', flat=True).first()
+    if cloture is not None:
+        raise ValueError(f"La journée du {cloture} est clôturée")
+    for (jour, mode), (montant, tickets) in cumuls.items():
+        increment = {'montant': F('montant') + montant, 'nb_tickets': F('nb_tickets') + len(tickets)}
+        if VenteJournaliere.objects.filter(jour=jour, mode=mode).update(**increment):
+            continue
+        try:
+            with transaction.atomic():
+                VenteJournaliere.objects.create(jour=jour, mode=mode, montant=montant, nb_tickets=len(tickets))
+        except IntegrityError:
+            # Une autre caisse a créé la ligne entre-temps
+            VenteJournaliere.objects.filter(jour=jour, mode=mode).update(**increment)
+
+
+def decompter_ventes_journalieres(paiements):
+    """Retire du cumul journalier des paiements sur le point d'être supprimés (suppression d'un produit).
+
+    À appeler dans la transaction de la suppression, avant elle. Un ticket
+    n'est décompté d'un mode que s'il ne lui reste aucun autre paiement dans
+    ce mode ; une ligne vidée est supprimée, comme après une reconstruction.
+    """
+    lignes = list(paiements.values_list('date_paiement', 'mode', 'montant_paye', 'ticket_id'))
+    if not lignes:
+        return
+    incrementer_version(VENTES)
+    restants = set(
+        Paiement.objects.filter(ticket_id__in={ticket_id for *_, ticket_id in lignes if ticket_id})
+        .exclude(id__in=paiements.values('id')).values_list('ticket_id', 'mode')
+    )
+    cumuls = {}
+    for date_paiement, mode, montant, ticket_id in lignes:
+        cle = (timezone.localdate(date_paiement), mode)
+        somme, tickets = cumuls.get(cle, (Decimal('0'), set()))
+        if ticket_id and (ticket_id, mode) not in restants:
+            tickets.add(ticket_id)
+        cumuls[cle] = (somme + montant, tickets)
+    for (jour, mode), (montant, tickets) in cumuls.items():
+        VenteJournaliere.objects.filter(jour=jour, mode=mode).update(
+            montant=F('montant') - montant, nb_tickets=F('nb_tickets') - len(tickets),
+        )
+    VenteJournaliere.objects.filter(jour__in={jour for jour, _ in cumuls}, montant=0, nb_tickets__lte=0).delete()
+
+
+def reconstruire_ventes_journalieres():
+    """Recalcule tout le cumul journalier depuis l'historique des paiements."""
+    lignes = (
+        Paiement.objects.order_by()
+        .annotate(jour=TruncDate('date_paiement'))
+        .values('jour', 'mode')
+        .annotate(montant=Sum('montant_paye'), nb_tickets=Count('ticket', distinct=True))
+    )
+    cumuls = [VenteJournaliere(**ligne) for ligne in lignes]
+    with transaction.atomic():
+        VenteJournaliere.objects.all().delete()
+        VenteJournaliere.objects.bulk_create(cumuls, batch_size=1000)
+        incrementer_version(VENTES)
+    return len(cumuls)
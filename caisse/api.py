@@ -0,0 +1,234 @@
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET, require_POST
+
+from .catalogue import LIMITE_STOCKS, stocks_produits
+from .encaissement import encaisser
+from .ingestion import TAILLE_MAX_LOT, enregistrer_tickets
+from .inventaire import inventaire_a_date
+from .models import Produit
+from .panier import ajouter_remise, enregistrer_panier, get_panier_dict, maj_ligne, prix_panier, vider
+from .recherche import LIMITE, rechercher
+from .stock import remettre_stock, retirer_stock
+
+
+def donnees(request):
+    """Corps de la requête : JSON si envoyé en JSON, sinon champs de formulaire."""
+    if request.content_type == 'application/json':
+        try:
+            contenu = json.loads(request.body or b'{}')
+        except ValueError:
+            return {}
+        return contenu if isinstance(contenu, dict) else {}
+    return request.POST
+
+
+def erreur(message, status=400):
+    return JsonResponse({'success': False, 'error': message}, status=status)
+
+
+def reponse_ligne(prix, str_id, **extra):
+    """Réponse delta : la seule ligne modifiée (None si elle a disparu) et le nouveau total."""
+    return JsonResponse({
+        'success': True,
+        'produit_id': int(str_id),
+        'ligne': prix['lignes'].get(str_id),
+        'total': prix['total'],
+        **extra,
+    })
+
+
+def lire_produit_id(valeurs):
+    try:
+        return int(valeurs.get('produit'))
+    except (TypeError, ValueError):
+        return None
+
+
+def produit_json(produit):
+    return {
+        'id': produit.id,
+        'nom': produit.nom,
+        'code_barre': produit.code_barre,
+        'prix': str(produit.prix),
+        'stock': produit.stock,
+    }
+
+
+@require_GET
+def api_produit_code(request, code):
+    """Lecture d'un code-barres : une recherche sur l'index unique de code_barre."""
+    produit = Produit.objects.filter(code_barre=code).first()
+    if produit is None:
+        return erreur("Code-barres inconnu", status=404)
+    return JsonResponse({'success': True, 'produit': produit_json(produit)})
+
+
+@require_GET
+def api_recherche(request):
+    try:
+        limite = min(int(request.GET.get('limite', LIMITE)), 100)
+    except ValueError:
+        limite = LIMITE
+    produits = rechercher(request.GET.get('q', ''), limite)
+    return JsonResponse({'success': True, 'produits': [produit_json(produit) for produit in produits]})
+
+
+@require_GET
+def api_stocks(request):
+    """Stocks des produits ?ids=1,2,3 (ceux que la grille affiche), au plus LIMITE_STOCKS par appel."""
+    try:
+        ids = [int(produit_id) for produit_id in request.GET.get('ids', '').split(',') if produit_id]
+    except ValueError:
+        return erreur("Identifiants produits invalides")
+    if len(ids) > LIMITE_STOCKS:
+        return erreur(f"Au plus {LIMITE_STOCKS} produits par appel")
+    return JsonResponse({'success': True, 'stocks': stocks_produits(ids)})
+
+
+@require_POST
+def api_ajouter(request):
+    valeurs = donnees(request)
+    produit_id = lire_produit_id(valeurs)
+    if produit_id is None and valeurs.get('code_barre'):
+        produit_id = Produit.objects.filter(code_barre=valeurs['code_barre']).values_list('id', flat=True).first()
+        if produit_id is None:
+            return erreur("Code-barres inconnu", status=404)
+    if produit_id is None:
+        return erreur("ID produit invalide")
+    if not retirer_stock(produit_id):
+        if not Produit.objects.filter(id=produit_id).exists():
+            return erreur("Produit introuvable", status=404)
+        return erreur("Stock insuffisant pour cet article", status=409)
+    produit = Produit.objects.get(id=produit_id)
+    str_id = str(produit_id)
+    panier = get_panier_dict(request)
+    prix_panier(request, panier)
+    panier[str_id] = panier.get(str_id, 0) + 1
+    enregistrer_panier(request, panier)
+    prix = maj_ligne(request, panier, str_id, produit)
+    return reponse_ligne(prix, str_id, stock=produit.stock)
+
+
+@require_POST
+def api_retirer(request):
+    produit_id = lire_produit_id(donnees(request))
+    str_id = str(produit_id)
+    panier = get_panier_dict(request)
+    if produit_id is None or str_id not in panier:
+        return erreur("Article absent du panier")
+    prix_panier(request, panier)
+    panier[str_id] -= 1
+    if panier[str_id] <= 0:
+        del panier[str_id]
+    enregistrer_panier(request, panier)
+    remettre_stock(produit_id)
+    prix = maj_ligne(request, panier, str_id)
+    stock = Produit.objects.filter(id=produit_id).values_list('stock', flat=True).first()
+    return reponse_ligne(prix, str_id, stock=stock)
+
+
+@require_POST
+def api_remise(request):
+    valeurs = donnees(request)
+    type_remise = valeurs.get('type', 'pourcentage')
+    try:
+        valeur = Decimal(str(valeurs.get('valeur', '0')))
+    except InvalidOperation:
+        return erreur("Valeur remise invalide")
+    if type_remise not in ('pourcentage', 'fixe') or not valeur > 0 or (type_remise == 'pourcentage' and valeur > 100):
+        return erreur("Valeur de remise invalide")
+    panier = get_panier_dict(request)
+    produit_id = lire_produit_id(valeurs)
+    if valeurs.get('produit') in (None, ''):
+        prix = ajouter_remise(request, panier, type_remise, valeur)
+        return JsonResponse({'success': True, 'ligne': None, 'total': prix['total']})
+    str_id = str(produit_id)
+    if produit_id is None or str_id not in panier:
+        return erreur("Article absent du panier")
+    prix = ajouter_remise(request, panier, type_remise, valeur, str_id)
+    return reponse_ligne(prix, str_id)
+
+
+@require_POST
+def api_payer(request):
+    valeurs = donnees(request)
+    paiements = valeurs.get('paiements') or []
+    if not isinstance(paiements, list):
+        return erreur("Liste de paiements attendue")
+    reglements = []
+    for paiement in paiements:
+        if not isinstance(paiement, dict):
+            return erreur("Paiement invalide")
+        try:
+            mode = str(paiement.get('mode', '')).strip()
+            montant = Decimal(str(paiement.get('montant', '0')))
+        except InvalidOperation:
+            return erreur("Paiement invalide")
+        if not montant.is_finite():
+            return erreur("Paiement invalide")
+        if mode and montant > 0:
+            reglements.append((mode, montant))
+    panier = get_panier_dict(request)
+    try:
+        total, ventes, _ = encaisser(panier, reglements)
+    except ValueError as e:
+        return erreur(str(e))
+    enregistrer_panier(request, {})
+    vider(request)
+    return JsonResponse({
+        'success': True, 'total': str(total), 'ticket': ventes[0].ticket_id, 'ventes': [vente.id for vente in ventes],
+    })
+
+
+@require_POST
+def api_tickets(request):
+    """Lot de tickets complets mis en file par une caisse : {"tickets": [{"cle", "lignes", "remises", "paiements"}, ...]}."""
+    tickets = donnees(request).get('tickets')
+    if not isinstance(tickets, list) or not tickets:
+        return erreur("Liste de tickets attendue")
+    if len(tickets) > TAILLE_MAX_LOT:
+        return erreur(f"Au plus {TAILLE_MAX_LOT} tickets par envoi", status=413)
+    resultats = enregistrer_tickets(tickets)
+    if any(resultat['statut'] == 'a_renvoyer' for resultat in resultats):
+        reponse = JsonResponse({'success': False, 'error': "Conflit d'écriture, renvoyer le lot", 'tickets': resultats}, status=503)
+        reponse['Retry-After'] = '1'
+        return reponse
+    return JsonResponse({'success': True, 'tickets': resultats})
+
+
+@require_GET
+def api_stock_a_date(request):
+    """Stock et valorisation à un instant : ?date=2026-01-31T20:00[&produit=1&produit=2]."""
+    moment = timezone.now()
+    if request.GET.get('date'):
+        try:
+            # parse_datetime lève ValueError sur une date impossible (30 février)
+            moment = parse_datetime(request.GET['date'])
+        except ValueError:
+            moment = None
+        if moment is None:
+            return erreur("Date invalide")
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+    try:
+        produit_ids = [int(produit_id) for produit_id in request.GET.getlist('produit')] or None
+    except ValueError:
+        return erreur("Identifiants produits invalides")
+    try:
+        inventaire = inventaire_a_date(moment, produit_ids)
+    except ValueError as e:
+        # Seul motif : aucun instantané avant cette date (message déjà rédigé pour l'utilisateur)
+        return erreur(str(e))
+    return JsonResponse({
+        'success': True,
+        'date': moment.isoformat(),
+        'instantane': inventaire['instantane'].isoformat(),
+        'unites': inventaire['unites'],
+        'valeur': str(inventaire['valeur']),
+        'stocks': {str(produit_id): stock for produit_id, stock in inventaire['stocks'].items()},
+    })
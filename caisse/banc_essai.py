@@ -0,0 +1,52 @@
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+
+@contextmanager
+def base_jetable(**reglages):
+    """Crée une base vide et migrée comme pour les tests, puis la détruit.
+
+    Sous SQLite, la base est un fichier temporaire (WAL et verrous ne
+    s'appliquent pas à une base en mémoire) ; sous PostgreSQL, c'est la base
+    test_<nom> de DATABASE_URL. `reglages` surcharge des settings le temps du banc.
+    """
+    dossier = None
+    if connection.vendor == 'sqlite':
+        dossier = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = str(Path(dossier) / 'banc.sqlite3')
+    with override_settings(**reglages):
+        ancien_nom = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(ancien_nom, verbosity=0)
+            if dossier:
+                shutil.rmtree(dossier, ignore_errors=True)
+
+
+def mesurer(fonction, repetitions=5, preparer=None):
+    """Exécute `fonction` plusieurs fois ; durées en ms et nombre de requêtes SQL de la dernière exécution.
+
+    `preparer`, appelé avant chaque exécution, n'est pas chronométré.
+    """
+    durees = []
+    for _ in range(repetitions):
+        if preparer:
+            preparer()
+        with CaptureQueriesContext(connection) as requetes:
+            debut = time.perf_counter()
+            fonction()
+            durees.append((time.perf_counter() - debut) * 1000)
+    return {
+        'mediane_ms': round(statistics.median(durees), 2),
+        'min_ms': round(min(durees), 2),
+        'max_ms': round(max(durees), 2),
+        'requetes': len(requetes),
+    }
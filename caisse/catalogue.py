@@ -0,0 +1,53 @@
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .models import Produit
+from .versions import CATALOGUE, incrementer_version, version
+
+DUREE_CACHE = 60 * 60
+# Stock à partir duquel la grille signale le produit (bouton rouge, lien de réassort)
+SEUIL_ALERTE = 5
+# Produits dont la page peut demander le stock en un appel (ceux affichés à l'écran)
+LIMITE_STOCKS = 200
+
+
+def invalider_catalogue():
+    """À appeler quand un produit est créé, supprimé ou change de nom ou de prix, jamais pour un simple mouvement de stock."""
+    incrementer_version(CATALOGUE)
+
+
+def produits_catalogue(version_catalogue=None):
+    """Liste des produits de la grille (sans le stock), mise en cache sous la version courante du catalogue."""
+    if version_catalogue is None:
+        version_catalogue = version(CATALOGUE)
+    cle = f'catalogue:produits:{version_catalogue}'
+    produits = cache.get(cle)
+    if produits is None:
+        produits = list(Produit.objects.order_by('id').values('id', 'nom', 'prix'))
+        cache.set(cle, produits, DUREE_CACHE)
+    return produits
+
+
+def grille_catalogue():
+    """HTML de la grille produits de la caisse.
+
+    Tant que la version du catalogue ne change pas, la page caisse ne fait
+    qu'une requête (la version) au lieu de relire et re-rendre tous les produits.
+    Le fragment ne contient aucun jeton CSRF : il est partagé entre sessions.
+    Il ne contient pas non plus les stocks, qui changent à chaque vente :
+    la page demande ceux des produits affichés (stocks_produits).
+    """
+    version_catalogue = version(CATALOGUE)
+    cle = f'catalogue:grille:{version_catalogue}'
+    html = cache.get(cle)
+    if html is None:
+        html = render_to_string('caisse/catalogue_grille.html', {'produits': produits_catalogue(version_catalogue)})
+        cache.set(cle, html, DUREE_CACHE)
+    return mark_safe(html)
+
+
+def stocks_produits(ids):
+    """{produit_id: stock} des seuls produits demandés (au plus LIMITE_STOCKS), par clé primaire, jamais mis en cache."""
+    return dict(Produit.objects.filter(id__in=list(ids)[:LIMITE_STOCKS]).values_list('id', 'stock'))
+
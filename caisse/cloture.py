@@ -0,0 +1,154 @@
+import tempfile
+from decimal import Decimal
+
+from django.core.files import File
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from .agregats import MODES, debut_de_journee, fin_de_journee, paiements_entre, tickets_entre
+from .models import MODES_PAIEMENT, ClotureJournee, Reassort, Remise, Vente
+from .versions import VENTES, incrementer_version
+
+LIBELLES_MODES = dict(MODES_PAIEMENT)
+CENTIME = Decimal('0.01')
+
+
+def montant(valeur):
+    return str((valeur or Decimal('0')).quantize(CENTIME))
+
+
+def donnees_z(jour):
+    """Chiffres du rapport Z d'une journée, en six requêtes d'agrégat.
+
+    Les montants sont des chaînes : le résultat est stocké tel quel (JSON) à la clôture.
+    """
+    paiements = paiements_entre(jour, jour)
+    tickets = tickets_entre(jour, jour)
+
+    # mode IN (...) : une recherche par mode sur l'index (mode, date_paiement), déjà groupée par mode
+    par_mode = [
+        {'mode': mode, 'libelle': LIBELLES_MODES.get(mode, mode), 'nb': nb, 'montant': montant(somme)}
+        for mode, nb, somme in paiements.filter(mode__in=MODES).order_by('mode').values_list('mode')
+        .annotate(nb=Count('ticket', distinct=True), montant=Sum('montant_paye'))
+    ]
+    total_encaisse = paiements.aggregate(total=Sum('montant_paye'))['total'] or Decimal('0')
+    totaux = tickets.aggregate(
+        nb=Count('id'), net=Sum('total'), brut=Sum('total_brut'), articles=Sum('nb_articles'),
+    )
+    remises = Remise.objects.filter(ticket__in=tickets).aggregate(
+        article=Count('id', filter=Q(appliquee_a_produit__isnull=False)),
+        globales=Count('id', filter=Q(appliquee_a_produit__isnull=True)),
+    )
+    reassorts = Reassort.objects.filter(
+        date_reassort__gte=debut_de_journee(jour), date_reassort__lt=fin_de_journee(jour),
+    ).aggregate(nb=Count('id'), unites=Sum('quantite_ajoutee'))
+    produits = [
+        {'nom': nom, 'quantite': quantite, 'total': montant(total)}
+        for nom, quantite, total in Vente.objects.filter(ticket__in=tickets).values_list('produit__nom')
+        .annotate(quantite=Sum('quantite'), total=Sum('total')).order_by('-total', 'produit__nom')
+    ]
+
+    nb_tickets = totaux['nb']
+    return {
+        'jour': jour.isoformat(),
+        'par_mode': par_mode,
+        'nb_tickets': nb_tickets,
+        'total_encaisse': montant(total_encaisse),
+        'panier_moyen': montant(totaux['net'] / nb_tickets if nb_tickets else None),
+        'articles_vendus': totaux['articles'] or 0,
+        'remises_article': remises['article'],
+        'remises_globales': remises['globales'],
+        # Écart entre le prix catalogue au moment de la vente et le total des tickets
+        'montant_remises': montant(max(Decimal('0'), (totaux['brut'] or Decimal('0')) - (totaux['net'] or Decimal('0')))),
+        'reassorts': reassorts['nb'],
+        'unites_reassorties': reassorts['unites'] or 0,
+        'produits': produits,
+    }
+
+
+def ecrire_pdf(fichier, donnees, provisoire=False):
+    """Rapport Z en PDF (reportlab/platypus), écrit directement dans `fichier`."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import cm
+    from reportlab.platypus import LongTable, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+    styles = getSampleStyleSheet()
+    style_tableau = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+        ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ])
+    titre = f"Rapport Z du {donnees['jour']}" + (" (provisoire)" if provisoire else "")
+    elements = [Paragraph(titre, styles['Title'])]
+
+    lignes = [['Mode', 'Tickets', 'Montant']]
+    lignes += [[m['libelle'], m['nb'], f"{m['montant']} €"] for m in donnees['par_mode']]
+    lignes.append(['Total', donnees['nb_tickets'], f"{donnees['total_encaisse']} €"])
+    tableau = Table(lignes, colWidths=[7 * cm, 3 * cm, 4 * cm])
+    tableau.setStyle(style_tableau)
+    elements += [Paragraph("Encaissements", styles['Heading2']), tableau, Spacer(1, 0.5 * cm)]
+
+    resume = [
+        ['Panier moyen', f"{donnees['panier_moyen']} €"],
+        ['Articles vendus', donnees['articles_vendus']],
+        ['Remises article / globales', f"{donnees['remises_article']} / {donnees['remises_globales']}"],
+        ['Montant des remises', f"{donnees['montant_remises']} €"],
+        ['Réassorts (unités)', f"{donnees['reassorts']} ({donnees['unites_reassorties']})"],
+    ]
+    tableau = Table(resume, colWidths=[7 * cm, 7 * cm])
+    tableau.setStyle(TableStyle([('GRID', (0, 0), (-1, -1), 0.25, colors.grey), ('ALIGN', (1, 0), (-1, -1), 'RIGHT')]))
+    elements += [Paragraph("Résumé", styles['Heading2']), tableau, Spacer(1, 0.5 * cm)]
+
+    lignes = [['Produit', 'Quantité', 'Total']]
+    lignes += [[p['nom'], p['quantite'], f"{p['total']} €"] for p in donnees['produits']]
+    # LongTable : découpée sur autant de pages que nécessaire, en-tête répété
+    tableau = LongTable(lignes, colWidths=[10 * cm, 2 * cm, 3 * cm], repeatRows=1)
+    tableau.setStyle(style_tableau)
+    elements += [Paragraph("Ventes par produit", styles['Heading2']), tableau]
+
+    SimpleDocTemplate(fichier, pagesize=A4, title=titre).build(elements)
+
+
+def pdf_temporaire(donnees, provisoire=False):
+    """PDF dans un fichier temporaire anonyme, rembobiné, à servir par FileResponse."""
+    fichier = tempfile.TemporaryFile(suffix='.pdf')
+    try:
+        ecrire_pdf(fichier, donnees, provisoire)
+    except BaseException:
+        fichier.close()
+        raise
+    fichier.seek(0)
+    return fichier
+
+
+def cloturer(jour, utilisateur=None):
+    """Fige le rapport Z du jour (chiffres et PDF). Lève ValueError si le jour est futur ou déjà clôturé.
+
+    Tout se fait dans une transaction qui commence par verrouiller la ligne
+    de version VENTES, comme cumuler_ventes_journalieres : une vente en cours
+    est validée avant le calcul et y figure, une vente suivante voit la
+    clôture et est refusée.
+    """
+    if jour > timezone.localdate():
+        raise ValueError("Impossible de clôturer une journée future")
+    cloture = ClotureJournee(jour=jour, utilisateur=utilisateur)
+    try:
+        with transaction.atomic():
+            incrementer_version(VENTES)
+            if ClotureJournee.objects.filter(jour=jour).exists():
+                raise ValueError(f"La journée du {jour} est déjà clôturée")
+            cloture.donnees = donnees_z(jour)
+            with pdf_temporaire(cloture.donnees) as fichier:
+                cloture.pdf.save(f"rapport_z_{jour.isoformat()}.pdf", File(fichier), save=False)
+            cloture.save()
+    except IntegrityError:
+        cloture.pdf.delete(save=False)
+        raise ValueError(f"La journée du {jour} est déjà clôturée")
+    except BaseException:
+        if cloture.pdf:
+            cloture.pdf.delete(save=False)
+        raise
+    return cloture
@@ -0,0 +1,73 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, Q, Value, When
+from django.utils import timezone
+
+from .agregats import MODES, cumuler_ventes_journalieres
+from .models import ClotureJournee, Paiement, Remise, Ticket, Vente
+from .panier import calculer_panier, invalider_remises, total_panier
+
+
+def rattacher_remises(ventes):
+    """Rattache en un seul UPDATE les remises en attente aux ventes créées et à leur ticket.
+
+    Remise article -> vente de son produit ; remise globale -> première vente.
+    Renvoie le nombre de remises rattachées.
+    """
+    vente_par_produit = Case(
+        *[When(appliquee_a_produit_id=vente.produit_id, then=Value(vente.id)) for vente in ventes],
+        default=Value(ventes[0].id),
+        output_field=BigIntegerField(),
+    )
+    produit_ids = [vente.produit_id for vente in ventes]
+    return Remise.objects.filter(appliquee_a_vente__isnull=True).filter(
+        Q(appliquee_a_produit__in=produit_ids) | Q(appliquee_a_produit__isnull=True)
+    ).update(appliquee_a_vente_id=vente_par_produit, ticket_id=ventes[0].ticket_id)
+
+
+def encaisser(panier, reglements):
+    """Enregistre la vente du panier {str_id: quantite} réglé par [(mode, montant), ...].
+
+    Tout se fait dans une transaction : tarification (2 requêtes), le
+    ticket, un bulk_create des ventes, un des paiements, un UPDATE des
+    remises. Lève ValueError si les montants ne couvrent pas exactement le
+    total, si un mode de paiement est inconnu, ou si la journée est déjà
+    clôturée (son rapport Z est figé).
+    """
+    inconnus = {mode for mode, _ in reglements} - set(MODES)
+    if inconnus:
+        raise ValueError(f"Mode de paiement inconnu : {', '.join(sorted(inconnus))}")
+    with transaction.atomic():
+        maintenant = timezone.now()
+        if ClotureJournee.objects.filter(jour=timezone.localdate(maintenant)).exists():
+            raise ValueError(f"La journée du {timezone.localdate(maintenant)} est clôturée")
+        prix = calculer_panier(panier)
+        total = total_panier(prix)
+        somme = sum((montant for _, montant in reglements), Decimal('0'))
+        if not prix['lignes'] or not reglements or abs(somme - total) >= Decimal('0.01'):
+            raise ValueError(f"Montant payé {somme} ≠ total {total} ou panier vide ou modes manquants")
+
+        lignes = prix['lignes'].values()
+        ticket = Ticket.objects.create(
+            date_ticket=maintenant,
+            total=total,
+            total_brut=sum((Decimal(ligne['prix']) * ligne['quantite'] for ligne in lignes), Decimal('0')),
+            nb_articles=sum(ligne['quantite'] for ligne in lignes),
+        )
+        ventes = Vente.objects.bulk_create([
+            Vente(ticket=ticket, produit_id=ligne['produit_id'], quantite=ligne['quantite'],
+                  total=Decimal(ligne['total']), date_vente=maintenant)
+            for ligne in lignes
+        ])
+        # Paiements aussi rattachés à la dernière vente, pour les rapports qui passent encore par elle
+        paiements = Paiement.objects.bulk_create([
+            Paiement(ticket=ticket, vente=ventes[-1], mode=mode, montant_paye=montant, date_paiement=maintenant)
+            for mode, montant in reglements
+        ])
+        if rattacher_remises(ventes):
+            # Un UPDATE n'émet pas de signal : les paniers ouverts ne doivent plus compter ces remises
+            invalider_remises()
+        Remise.objects.filter(appliquee_a_vente__isnull=True).delete()
+        cumuler_ventes_journalieres(paiements)
+    return total, ventes, paiements
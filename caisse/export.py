@@ -0,0 +1,191 @@
+import tempfile
+from datetime import timedelta
+
+import xlsxwriter
+from django.core.files import File
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .agregats import MODES, agreger_jours, ca_par_jour_cumule, paiements_entre, ventes_entre
+from .models import ExportRapport
+from .recherche import RECHERCHE
+from .versions import VENTES, version
+
+TAILLE_CHUNK = 2000
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Export en cours sans progression depuis ce délai : son worker s'est arrêté
+DELAI_ABANDON = timedelta(minutes=10)
+MAX_TENTATIVES = 3
+
+
+def ecrire_classeur(fichier, agregats, ventes, paiements, date_debut=None, date_fin=None, progression=None):
+    """Écrit le rapport ligne par ligne (mode constant_memory d'xlsxwriter).
+
+    En constant_memory chaque ligne est vidée sur disque dès qu'on passe à la
+    suivante : il faut donc écrire strictement de haut en bas. `progression`,
+    si fourni, reçoit le nombre de ventes et paiements écrits tous les TAILLE_CHUNK.
+    """
+    ecrites = 0
+    workbook = xlsxwriter.Workbook(fichier, {'constant_memory': True, 'remove_timezone': True})
+    worksheet = workbook.add_worksheet('Rapports')
+
+    header_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1})
+    total_format = workbook.add_format({'bold': True, 'bg_color': '#90EE90'})
+    money_format = workbook.add_format({'num_format': '#,##0.00 €', 'border': 1})
+    date_format = workbook.add_format({'num_format': 'dd/mm/yyyy', 'border': 1})
+
+    row = 0
+    worksheet.write(row, 0, 'Période', header_format)
+    worksheet.write(row, 1, date_debut or 'Début', date_format)
+    worksheet.write(row, 2, date_fin or 'Fin', date_format)
+    row += 2
+
+    worksheet.write(row, 0, 'CA par Jour', header_format)
+    row += 1
+    headers = ['Date', 'Espèces', 'Carte', 'Chèque', 'Ticket', 'Total']
+    for col, header in enumerate(headers):
+        worksheet.write(row, col, header, header_format)
+    row += 1
+    for detail in agregats['jours']:
+        worksheet.write(row, 0, detail['date'], date_format)
+        for col, mode in enumerate(MODES, start=1):
+            worksheet.write(row, col, detail[mode], money_format)
+        worksheet.write(row, len(MODES) + 1, detail['total'], total_format)
+        row += 1
+    row += 2
+
+    for titre, libelle, cle, lignes in [
+        ('CA par Semaine', 'Semaine', 'semaine', agregats['semaines']),
+        ('CA par Mois', 'Mois', 'mois', agregats['mois']),
+        ('CA par Année', 'Année', 'an', agregats['annees']),
+    ]:
+        worksheet.write(row, 0, titre, header_format)
+        row += 1
+        worksheet.write(row, 0, libelle, header_format)
+        worksheet.write(row, 1, 'Total', header_format)
+        row += 1
+        for item in lignes:
+            worksheet.write(row, 0, str(item[cle]), date_format)
+            worksheet.write(row, 1, item['total'], money_format)
+            row += 1
+        row += 2
+
+    worksheet.write(row, 0, 'Ventes Détaillées', header_format)
+    row += 1
+    headers = ['Produit', 'Quantité', 'Total', 'Date']
+    for col, header in enumerate(headers):
+        worksheet.write(row, col, header, header_format)
+    row += 1
+    for vente in ventes.select_related('produit').iterator(chunk_size=TAILLE_CHUNK):
+        worksheet.write(row, 0, vente.produit.nom)
+        worksheet.write(row, 1, vente.quantite)
+        worksheet.write(row, 2, vente.total, money_format)
+        worksheet.write(row, 3, vente.date_vente, date_format)
+        row += 1
+        ecrites += 1
+        if progression and ecrites % TAILLE_CHUNK == 0:
+            progression(ecrites)
+    row += 2
+
+    worksheet.write(row, 0, 'Paiements Détaillés', header_format)
+    row += 1
+    headers = ['Mode', 'Montant', 'Date']
+    for col, header in enumerate(headers):
+        worksheet.write(row, col, header, header_format)
+    row += 1
+    for paiement in paiements.iterator(chunk_size=TAILLE_CHUNK):
+        worksheet.write(row, 0, paiement.get_mode_display())
+        worksheet.write(row, 1, paiement.montant_paye, money_format)
+        worksheet.write(row, 2, paiement.date_paiement, date_format)
+        row += 1
+        ecrites += 1
+        if progression and ecrites % TAILLE_CHUNK == 0:
+            progression(ecrites)
+
+    workbook.close()
+
+
+def version_donnees_export():
+    """Ventes (chaque encaissement) et produits (noms) : ce que contient le classeur."""
+    return f"{version(VENTES)}.{version(RECHERCHE)}"
+
+
+def demander_export(debut=None, fin=None, format='xlsx'):
+    """Renvoie l'export de cette période sur les données actuelles, créé en attente s'il n'existe pas.
+
+    Un export terminé ou en préparation pour la même demande est réutilisé ;
+    seul un export en erreur est refait.
+    """
+    criteres = {'format': format, 'date_debut': debut, 'date_fin': fin, 'version_donnees': version_donnees_export()}
+    export = ExportRapport.objects.filter(**criteres).exclude(statut='erreur').order_by('-id').first()
+    if export is None:
+        export = ExportRapport.objects.create(**criteres)
+    return export
+
+
+def relancer_abandonnes():
+    """Remet en attente les exports en cours dont le worker a disparu (arrêt, plantage).
+
+    Au-delà de MAX_TENTATIVES, l'export passe en erreur : une nouvelle
+    demande identique en créera un autre. Renvoie le nombre d'exports traités.
+    """
+    maintenant = timezone.now()
+    abandonnes = ExportRapport.objects.filter(statut='en_cours').filter(
+        Q(date_prise__lt=maintenant - DELAI_ABANDON) | Q(date_prise__isnull=True),
+    )
+    echoues = abandonnes.filter(tentatives__gte=MAX_TENTATIVES).update(
+        statut='erreur', erreur="Abandonné après plusieurs tentatives", date_fin_traitement=maintenant,
+    )
+    return echoues + abandonnes.update(statut='en_attente')
+
+
+def prendre_export():
+    """Réserve le plus ancien export en attente pour ce worker (UPDATE conditionnel), ou None.
+
+    Les exports abandonnés par un autre worker sont d'abord remis en attente.
+    """
+    relancer_abandonnes()
+    for export_id in ExportRapport.objects.filter(statut='en_attente').order_by('id').values_list('id', flat=True)[:10]:
+        if ExportRapport.objects.filter(id=export_id, statut='en_attente').update(
+            statut='en_cours', date_prise=timezone.now(), tentatives=F('tentatives') + 1,
+        ):
+            return ExportRapport.objects.get(id=export_id)
+    return None
+
+
+def executer_export(export):
+    paiements = paiements_entre(export.date_debut, export.date_fin)
+    ventes = ventes_entre(export.date_debut, export.date_fin).order_by('-date_vente', '-id')
+    paiements = paiements.order_by('-date_paiement', '-id')
+    nb_lignes = max(ventes.count() + paiements.count(), 1)
+
+    def progression(ecrites):
+        ExportRapport.objects.filter(id=export.id).update(
+            progression=min(99, ecrites * 100 // nb_lignes), date_prise=timezone.now(),
+        )
+
+    agregats = agreger_jours(ca_par_jour_cumule(export.date_debut, export.date_fin))
+    try:
+        with tempfile.TemporaryFile(suffix='.xlsx') as fichier:
+            ecrire_classeur(fichier, agregats, ventes, paiements, export.date_debut, export.date_fin, progression)
+            fichier.seek(0)
+            export.fichier.save(f"rapport_{export.id}.{export.format}", File(fichier), save=False)
+    except Exception as e:
+        export.statut = 'erreur'
+        export.erreur = str(e)
+    else:
+        export.statut = 'termine'
+        export.progression = 100
+    export.date_fin_traitement = timezone.now()
+    export.save(update_fields=['statut', 'erreur', 'progression', 'fichier', 'date_fin_traitement'])
+    return export
+
+
+def purger_exports(jours=7):
+    """Supprime les exports terminés (et leurs fichiers) demandés il y a plus de `jours` jours."""
+    anciens = ExportRapport.objects.filter(
+        statut__in=['termine', 'erreur'], date_demande__lt=timezone.now() - timedelta(days=jours),
+    )
+    for export in anciens.exclude(fichier=''):
+        export.fichier.delete(save=False)
+    return anciens.delete()[0]
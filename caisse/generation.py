@@ -0,0 +1,125 @@
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .agregats import MODES, reconstruire_ventes_journalieres
+from .catalogue import invalider_catalogue
+from .models import Paiement, Produit, Reassort, Remise, Ticket, Vente
+from .recherche import invalider_recherche
+from .stock import tracer
+
+TAILLE_LOT = 5000
+MOTS = (
+    'Café', 'Thé', 'Chocolat', 'Biscuit', 'Confiture', 'Pâtes', 'Riz', 'Huile', 'Savon', 'Lait',
+    'Jus', 'Eau', 'Farine', 'Sucre', 'Sel', 'Beurre', 'Yaourt', 'Fromage', 'Pain', 'Miel',
+)
+QUALIFICATIFS = ('noir', 'bio', 'vanille', 'citron', 'nature', 'complet', 'léger', 'extra', 'fraise', 'intense')
+
+
+def lots(total, taille=TAILLE_LOT):
+    for debut in range(0, total, taille):
+        yield min(taille, total - debut)
+
+
+def generer_produits(nb, hasard):
+    """Crée nb produits par bulk_create, stock initial tracé dans le journal ; renvoie {id: prix}."""
+    prix = {}
+    # Noms et codes-barres numérotés après les produits existants
+    numero = Produit.objects.order_by('-id').values_list('id', flat=True).first() or 0
+    for taille in lots(nb):
+        produits = []
+        for _ in range(taille):
+            numero += 1
+            produits.append(Produit(
+                nom=f"{hasard.choice(MOTS)} {hasard.choice(QUALIFICATIFS)} {numero}",
+                code_barre=f"{2000000000000 + numero}",
+                prix=Decimal(hasard.randint(50, 5000)) / 100,
+                stock=hasard.randint(0, 200),
+            ))
+        for produit in Produit.objects.bulk_create(produits):
+            prix[produit.id] = produit.prix
+        tracer([(produit.id, 'ajustement', produit.stock) for produit in produits])
+    return prix
+
+
+def generer_ventes(nb, prix, jours, hasard):
+    """nb tickets d'un article répartis sur les `jours` derniers jours, chacun réglé par un paiement."""
+    ids = list(prix)
+    maintenant = timezone.now()
+    for taille in lots(nb):
+        tickets, ventes = [], []
+        for _ in range(taille):
+            produit_id = hasard.choice(ids)
+            quantite = hasard.randint(1, 3)
+            total = prix[produit_id] * quantite
+            ticket = Ticket(
+                date_ticket=maintenant - timedelta(seconds=hasard.randint(0, jours * 86400)),
+                total=total, total_brut=total, nb_articles=quantite,
+            )
+            tickets.append(ticket)
+            ventes.append(Vente(produit_id=produit_id, quantite=quantite, total=total, date_vente=ticket.date_ticket))
+        Ticket.objects.bulk_create(tickets)
+        for ticket, vente in zip(tickets, ventes):
+            vente.ticket = ticket
+        ventes = Vente.objects.bulk_create(ventes)
+        Paiement.objects.bulk_create(
+            Paiement(ticket=vente.ticket, vente=vente, mode=hasard.choice(MODES), montant_paye=vente.total,
+                     date_paiement=vente.date_vente)
+            for vente in ventes
+        )
+
+
+def generer_remises(nb, hasard):
+    """Remises déjà rattachées à des ventes existantes (historique) ; renvoie le nombre créé."""
+    max_id = Vente.objects.order_by('-id').values_list('id', flat=True).first()
+    if not max_id:
+        return 0
+    crees = 0
+    for taille in lots(nb):
+        ventes = Vente.objects.filter(id__in=[hasard.randint(1, max_id) for _ in range(taille)])
+        crees += len(Remise.objects.bulk_create(
+            Remise(type='pourcentage', valeur=Decimal(hasard.choice((5, 10, 20))),
+                   appliquee_a_produit_id=produit_id, appliquee_a_vente_id=vente_id, ticket_id=ticket_id)
+            for vente_id, produit_id, ticket_id in ventes.values_list('id', 'produit_id', 'ticket_id')
+        ))
+    return crees
+
+
+def generer_reassorts(nb, prix, jours, hasard):
+    """Traces de réassort seules : les stocks générés sont déjà ceux d'après réassort."""
+    ids = list(prix)
+    maintenant = timezone.now()
+    for taille in lots(nb):
+        reassorts = []
+        for _ in range(taille):
+            quantite = hasard.randint(5, 50)
+            avant = hasard.randint(0, 10)
+            reassorts.append(Reassort(
+                produit_id=hasard.choice(ids), quantite_ajoutee=quantite, stock_avant=avant,
+                stock_apres=avant + quantite,
+                date_reassort=maintenant - timedelta(seconds=hasard.randint(0, jours * 86400)),
+            ))
+        Reassort.objects.bulk_create(reassorts)
+
+
+def generer(produits=1000, ventes=10000, remises=0, reassorts=0, jours=365, graine=0):
+    """Remplit la base d'un jeu de données synthétique, uniquement par bulk_create.
+
+    Le cumul journalier est recalculé à la fin et les caches invalidés.
+    Renvoie le nombre de lignes créées par modèle.
+    """
+    hasard = random.Random(graine)
+    crees = {'produits': produits, 'ventes': 0, 'remises': 0, 'reassorts': 0}
+    with transaction.atomic():
+        prix = generer_produits(produits, hasard)
+        if prix:
+            generer_ventes(ventes, prix, jours, hasard)
+            generer_reassorts(reassorts, prix, jours, hasard)
+            crees.update(ventes=ventes, reassorts=reassorts, remises=generer_remises(remises, hasard))
+        reconstruire_ventes_journalieres()
+        invalider_catalogue()
+        invalider_recherche()
+    return crees
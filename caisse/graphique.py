@@ -0,0 +1,72 @@
+import hashlib
+import time
+from io import BytesIO
+
+from django.core.cache import cache
+
+from .agregats import MODES, agreger_jours, ca_par_jour_cumule
+from .models import MODES_PAIEMENT
+from .versions import VENTES, version
+
+DUREE_CACHE = 24 * 60 * 60
+
+# periode -> (liste dans agreger_jours, clé de la période dans chaque ligne)
+PERIODES = {
+    'jour': ('jours', 'date'),
+    'semaine': ('semaines', 'semaine'),
+    'mois': ('mois', 'mois'),
+    'an': ('annees', 'an'),
+}
+LIBELLES_MODES = dict(MODES_PAIEMENT)
+
+
+def cle_graphique(periode, debut, fin):
+    """Clé de cache : la période, les bornes et la version des ventes (changée à chaque encaissement)."""
+    return f'graphique:{periode}:{debut or ""}:{fin or ""}:{version(VENTES)}'
+
+
+def etag_graphique(cle):
+    return '"%s"' % hashlib.md5(cle.encode()).hexdigest()
+
+
+def dessiner(lignes, cle_periode, titre):
+    """PNG d'un histogramme empilé par mode de paiement.
+
+    matplotlib n'est importé qu'ici, au premier graphique réellement dessiné :
+    Figure sans pyplot, donc ni backend global ni état partagé entre threads.
+    """
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(10, 4), layout='constrained')
+    axes = figure.subplots()
+    etiquettes = [str(ligne[cle_periode]) for ligne in lignes]
+    positions = range(len(lignes))
+    bas = [0.0] * len(lignes)
+    for mode in MODES:
+        valeurs = [float(ligne[mode]) for ligne in lignes]
+        axes.bar(positions, valeurs, bottom=bas, label=LIBELLES_MODES.get(mode, mode))
+        bas = [b + v for b, v in zip(bas, valeurs)]
+    axes.set_xticks(list(positions), etiquettes, rotation=45, ha='right', fontsize=8)
+    axes.set_ylabel('€')
+    axes.set_title(titre)
+    if lignes:
+        axes.legend()
+    sortie = BytesIO()
+    figure.savefig(sortie, format='png', dpi=100)
+    return sortie.getvalue()
+
+
+def graphique_ca(periode, debut=None, fin=None):
+    """Renvoie (png, etag, genere_le) du CA par période, depuis le cache si les ventes n'ont pas changé.
+
+    genere_le est un timestamp, servi en Last-Modified.
+    """
+    cle = cle_graphique(periode, debut, fin)
+    entree = cache.get(cle)
+    if entree is None:
+        liste, cle_periode = PERIODES[periode]
+        lignes = agreger_jours(ca_par_jour_cumule(debut, fin))[liste]
+        entree = (dessiner(lignes, cle_periode, f"Chiffre d'affaires par {periode}"), int(time.time()))
+        cache.set(cle, entree, DUREE_CACHE)
+    png, genere_le = entree
+    return png, etag_graphique(cle), genere_le
@@ -0,0 +1,130 @@
+import codecs
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .catalogue import invalider_catalogue
+from .models import Produit
+from .recherche import invalider_recherche
+from .stock import tracer
+
+TAILLE_LOT = 1000
+PRIX_MAX = Decimal('99999999.99')
+LONGUEURS_EAN = (8, 12, 13, 14)
+
+
+def lire_lignes(fichier):
+    """Décode le fichier uploadé ligne par ligne, sans le charger en mémoire."""
+    return codecs.iterdecode(fichier, 'utf-8-sig')
+
+
+def valider_ligne(row):
+    nom = (row.get('nom') or '').strip()
+    if not nom:
+        raise ValueError("nom manquant")
+    if len(nom) > Produit._meta.get_field('nom').max_length:
+        raise ValueError("nom trop long")
+    try:
+        prix = Decimal((row.get('prix') or '').strip())
+    except InvalidOperation:
+        raise ValueError(f"prix invalide: {row.get('prix')!r}")
+    if not prix.is_finite() or prix < 0 or prix > PRIX_MAX:
+        raise ValueError(f"prix invalide: {row.get('prix')!r}")
+    try:
+        stock = int((row.get('stock') or '').strip())
+    except ValueError:
+        raise ValueError(f"stock invalide: {row.get('stock')!r}")
+    if stock < 0:
+        raise ValueError(f"stock négatif: {stock}")
+    code_barre = (row.get('code_barre') or '').strip() or None
+    if code_barre is not None and not (code_barre.isdigit() and len(code_barre) in LONGUEURS_EAN):
+        raise ValueError(f"code-barres invalide: {code_barre!r}")
+    return {'nom': nom, 'code_barre': code_barre, 'prix': prix.quantize(Decimal('0.01')), 'stock': stock}
+
+
+def cle_ligne(valeurs):
+    """Clé d'upsert : le code-barres s'il est fourni, sinon le nom."""
+    if valeurs['code_barre']:
+        return ('code_barre', valeurs['code_barre'])
+    return ('nom', valeurs['nom'])
+
+
+def enregistrer_lot(lot):
+    """Upsert d'un lot {cle_ligne: valeurs} : deux SELECT, un bulk_create, un bulk_update,
+    puis les écarts de stock en ajustements dans le journal des mouvements.
+
+    Une ligne avec code-barres met à jour le produit portant ce code, ou à
+    défaut un produit de même nom encore sans code-barres.
+    """
+    codes = [valeur for type_cle, valeur in lot if type_cle == 'code_barre']
+    par_code = {produit.code_barre: produit for produit in Produit.objects.filter(code_barre__in=codes)}
+    par_nom = {}
+    noms = {valeurs['nom'] for valeurs in lot.values()}
+    for produit in Produit.objects.filter(nom__in=noms).order_by('-id'):
+        par_nom[produit.nom] = produit
+    a_creer = []
+    a_modifier = {}
+    anciens_stocks = {}
+    for (type_cle, valeur), valeurs in lot.items():
+        if type_cle == 'code_barre':
+            produit = par_code.get(valeur)
+            if produit is None:
+                produit = par_nom.get(valeurs['nom'])
+                if produit is not None and produit.code_barre:
+                    produit = None
+        else:
+            produit = par_nom.get(valeur)
+        if produit is None:
+            a_creer.append(Produit(**valeurs))
+        else:
+            produit = a_modifier.get(produit.id, produit)
+            anciens_stocks.setdefault(produit.id, produit.stock)
+            produit.nom = valeurs['nom']
+            produit.prix = valeurs['prix']
+            produit.stock = valeurs['stock']
+            produit.code_barre = valeurs['code_barre'] or produit.code_barre
+            a_modifier[produit.id] = produit
+    Produit.objects.bulk_create(a_creer, batch_size=TAILLE_LOT)
+    Produit.objects.bulk_update(list(a_modifier.values()), ['nom', 'prix', 'stock', 'code_barre'], batch_size=TAILLE_LOT)
+    tracer(
+        [(produit.id, 'ajustement', produit.stock) for produit in a_creer]
+        + [(produit.id, 'ajustement', produit.stock - anciens_stocks[produit.id]) for produit in a_modifier.values()]
+    )
+    return len(a_creer), len(a_modifier)
+
+
+def importer_csv(fichier, taille_lot=TAILLE_LOT):
+    rapport = {'crees': 0, 'mis_a_jour': 0, 'erreurs': []}
+    reader = csv.DictReader(lire_lignes(fichier))
+    colonnes = set(reader.fieldnames or [])
+    manquantes = {'nom', 'prix', 'stock'} - colonnes
+    if manquantes:
+        rapport['erreurs'].append((1, f"colonnes manquantes: {', '.join(sorted(manquantes))}"))
+        return rapport
+
+    with transaction.atomic():
+        lot = {}
+        for row in reader:
+            try:
+                valeurs = valider_ligne(row)
+            except ValueError as e:
+                rapport['erreurs'].append((reader.line_num, str(e)))
+                continue
+            # Un même produit répété dans le fichier : la dernière ligne l'emporte
+            cle = cle_ligne(valeurs)
+            lot.pop(cle, None)
+            lot[cle] = valeurs
+            if len(lot) >= taille_lot:
+                crees, modifies = enregistrer_lot(lot)
+                rapport['crees'] += crees
+                rapport['mis_a_jour'] += modifies
+                lot = {}
+        if lot:
+            crees, modifies = enregistrer_lot(lot)
+            rapport['crees'] += crees
+            rapport['mis_a_jour'] += modifies
+        if rapport['crees'] or rapport['mis_a_jour']:
+            invalider_catalogue()
+            invalider_recherche()
+    return rapport
@@ -0,0 +1,257 @@
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .agregats import MODES, cumuler_ventes_journalieres
+from .models import ClotureJournee, Paiement, Produit, Remise, Ticket, Vente
+from .panier import appliquer_remises
+from .promotions import moteur_depuis
+from .stock import retirer_stocks
+
+TAILLE_MAX_LOT = 500
+LONGUEUR_CLE = 64
+CENTIME = Decimal('0.01')
+# Horloge d'une caisse en avance sur le serveur
+AVANCE_TOLEREE = timedelta(minutes=5)
+
+
+def lire_decimal(valeur, message):
+    try:
+        return Decimal(str(valeur))
+    except (InvalidOperation, ValueError):
+        raise ValueError(message)
+
+
+def lire_reference(valeurs):
+    """('id', n) pour {"produit": n}, ('code', c) pour {"code_barre": c}, None sinon."""
+    if valeurs.get('produit') not in (None, ''):
+        try:
+            return ('id', int(valeurs['produit']))
+        except (TypeError, ValueError):
+            raise ValueError("ID produit invalide")
+    if valeurs.get('code_barre'):
+        return ('code', str(valeurs['code_barre']))
+    return None
+
+
+def lire_ticket(brut):
+    """Valide la forme d'un ticket reçu, sans requête. Lève ValueError."""
+    if not isinstance(brut, dict):
+        raise ValueError("Ticket invalide")
+    cle = brut.get('cle')
+    if not isinstance(cle, str) or not 0 < len(cle) <= LONGUEUR_CLE:
+        raise ValueError(f"Clé d'idempotence manquante ou de plus de {LONGUEUR_CLE} caractères")
+
+    date = timezone.now()
+    if brut.get('date'):
+        date = parse_datetime(str(brut['date']))
+        if date is None:
+            raise ValueError("Date invalide")
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date)
+        if date > timezone.now() + AVANCE_TOLEREE:
+            raise ValueError("Date dans le futur")
+
+    lignes = []
+    for ligne in brut.get('lignes') or []:
+        if not isinstance(ligne, dict):
+            raise ValueError("Ligne invalide")
+        reference = lire_reference(ligne)
+        if reference is None:
+            raise ValueError("Ligne sans produit")
+        quantite = ligne.get('quantite', 1)
+        # bool est un int en Python : true ne doit pas valoir 1
+        if not isinstance(quantite, int) or isinstance(quantite, bool) or quantite <= 0:
+            raise ValueError("Quantité invalide")
+        # Prix unitaire avant promotions pratiqué en caisse, s'il diffère du catalogue au moment de la synchronisation
+        prix = None
+        if ligne.get('prix') not in (None, ''):
+            prix = lire_decimal(ligne['prix'], "Prix invalide")
+            if prix < 0:
+                raise ValueError("Prix invalide")
+        lignes.append((reference, quantite, prix))
+    if not lignes:
+        raise ValueError("Ticket sans article")
+
+    remises = []
+    for remise in brut.get('remises') or []:
+        if not isinstance(remise, dict):
+            raise ValueError("Remise invalide")
+        type_remise = remise.get('type', 'pourcentage')
+        valeur = lire_decimal(remise.get('valeur', '0'), "Valeur de remise invalide")
+        if type_remise not in ('pourcentage', 'fixe') or not valeur > 0 or (type_remise == 'pourcentage' and valeur > 100):
+            raise ValueError("Valeur de remise invalide")
+        remises.append((lire_reference(remise), type_remise, valeur))
+
+    paiements = []
+    for paiement in brut.get('paiements') or []:
+        if not isinstance(paiement, dict) or paiement.get('mode') not in MODES:
+            raise ValueError("Mode de paiement invalide")
+        montant = lire_decimal(paiement.get('montant', '0'), "Paiement invalide")
+        if montant > 0:
+            paiements.append((paiement['mode'], montant))
+    if not paiements:
+        raise ValueError("Ticket sans paiement")
+
+    return {'cle': cle, 'date': date, 'lignes': lignes, 'remises': remises, 'paiements': paiements}
+
+
+def tarifer(ticket, produits, clotures, moteur):
+    """Ticket et ventes (non enregistrés) d'un ticket lu, avec les produits déjà chargés.
+
+    Les promotions sont celles en vigueur à la date du ticket. Lève ValueError.
+    """
+    if timezone.localdate(ticket['date']) in clotures:
+        raise ValueError(f"La journée du {timezone.localdate(ticket['date'])} est clôturée")
+
+    def produit(reference):
+        if reference not in produits:
+            raise ValueError(f"Produit introuvable : {reference[1]}")
+        return produits[reference]
+
+    par_produit = {}
+    globales = []
+    remises = []
+    for reference, type_remise, valeur in ticket['remises']:
+        produit_id = produit(reference)[0] if reference else None
+        if produit_id is None:
+            globales.append((type_remise, valeur))
+        else:
+            par_produit.setdefault(produit_id, []).append((type_remise, valeur))
+        remises.append((produit_id, type_remise, valeur))
+
+    ventes = []
+    brut = Decimal('0')
+    for reference, quantite, prix in ticket['lignes']:
+        produit_id, prix_catalogue = produit(reference)
+        prix = prix_catalogue if prix is None else prix
+        brut += prix * quantite
+        promotion = moteur.remise_ligne(produit_id, prix, quantite, ticket['date'])[0]
+        ventes.append(Vente(
+            produit_id=produit_id, quantite=quantite, date_vente=ticket['date'],
+            total=appliquer_remises(prix * quantite - promotion, par_produit.get(produit_id, [])),
+        ))
+    if not set(par_produit) <= {vente.produit_id for vente in ventes}:
+        raise ValueError("Remise sur un article absent du ticket")
+
+    total = sum((vente.total for vente in ventes), Decimal('0'))
+    total = appliquer_remises(total - moteur.remise_total(total, ticket['date'])[0], globales)
+    somme = sum((montant for _, montant in ticket['paiements']), Decimal('0'))
+    if abs(somme - total) >= CENTIME:
+        raise ValueError(f"Montant payé {somme} ≠ total {total}")
+    entete = Ticket(
+        cle=ticket['cle'], date_ticket=ticket['date'], total=total.quantize(CENTIME), total_brut=brut,
+        nb_articles=sum(vente.quantite for vente in ventes),
+    )
+    return entete, ventes, remises
+
+
+def inserer(lus):
+    """Enregistre les tickets lus {index: ticket} en un nombre fixe de requêtes ; renvoie {index: résultat}."""
+    resultats = {}
+    cles = [ticket['cle'] for ticket in lus.values()]
+    connues = dict(Ticket.objects.filter(cle__in=cles).values_list('cle', 'id'))
+
+    ids, codes = set(), set()
+    for ticket in lus.values():
+        references = [ligne[0] for ligne in ticket['lignes']] + [remise[0] for remise in ticket['remises']]
+        for genre, valeur in filter(None, references):
+            (ids if genre == 'id' else codes).add(valeur)
+    produits = {}
+    for produit_id, code, prix in Produit.objects.filter(Q(id__in=ids) | Q(code_barre__in=codes)).values_list('id', 'code_barre', 'prix'):
+        produits[('id', produit_id)] = produits[('code', code)] = (produit_id, prix)
+    jours = {timezone.localdate(ticket['date']) for ticket in lus.values()}
+    clotures = set(ClotureJournee.objects.filter(jour__in=jours).values_list('jour', flat=True))
+    moteur = moteur_depuis(min(ticket['date'] for ticket in lus.values()))
+
+    a_creer = []
+    retenues = set()
+    for i, ticket in lus.items():
+        cle = ticket['cle']
+        if cle in connues or cle in retenues:
+            continue
+        try:
+            entete, ventes, remises = tarifer(ticket, produits, clotures, moteur)
+        except ValueError as e:
+            resultats[i] = {'cle': cle, 'statut': 'rejete', 'erreur': str(e)}
+            continue
+        retenues.add(cle)
+        a_creer.append((i, ticket, entete, ventes, remises))
+
+    Ticket.objects.bulk_create([entete for _, _, entete, _, _ in a_creer])
+    for _, _, entete, ventes, _ in a_creer:
+        for vente in ventes:
+            vente.ticket = entete
+    Vente.objects.bulk_create([vente for _, _, _, ventes, _ in a_creer for vente in ventes])
+    paiements, remises_creees, quantites = [], [], {}
+    for i, ticket, entete, ventes, remises in a_creer:
+        # Comme à l'encaissement : paiements aussi sur la dernière vente, remise globale sur la première
+        vente_par_produit = {}
+        for vente in ventes:
+            vente_par_produit.setdefault(vente.produit_id, vente)
+            quantites[vente.produit_id] = quantites.get(vente.produit_id, 0) + vente.quantite
+        paiements += [
+            Paiement(ticket=entete, vente=ventes[-1], mode=mode, montant_paye=montant, date_paiement=ticket['date'])
+            for mode, montant in ticket['paiements']
+        ]
+        remises_creees += [
+            Remise(ticket=entete, type=type_remise, valeur=valeur, appliquee_a_produit_id=produit_id,
+                   appliquee_a_vente=vente_par_produit[produit_id] if produit_id else ventes[0])
+            for produit_id, type_remise, valeur in remises
+        ]
+        connues[ticket['cle']] = entete.id
+        resultats[i] = {
+            'cle': ticket['cle'], 'statut': 'enregistre', 'ticket': entete.id,
+            'ventes': [vente.id for vente in ventes], 'total': str(entete.total),
+        }
+    # Une clé déjà enregistrée (ou en double dans le lot) est une nouvelle tentative : rien à refaire
+    for i, ticket in lus.items():
+        if i not in resultats:
+            resultats[i] = {'cle': ticket['cle'], 'statut': 'doublon', 'ticket': connues.get(ticket['cle'])}
+
+    Paiement.objects.bulk_create(paiements)
+    Remise.objects.bulk_create(remises_creees)
+    retirer_stocks(quantites)
+    cumuler_ventes_journalieres(paiements)
+    return resultats
+
+
+def enregistrer_tickets(tickets):
+    """Enregistre un lot de tickets complets envoyés par une caisse ; renvoie un résultat par ticket.
+
+    Chaque ticket porte une clé d'idempotence générée par la caisse : un
+    ticket déjà reçu est signalé « doublon » sans rien réécrire, un envoi
+    peut donc être rejoué sans risque. Les tickets valides sont écrits dans
+    une seule transaction par bulk_create (tickets, ventes, paiements,
+    remises) ; les stocks sont décrémentés sans condition, la vente ayant déjà
+    eu lieu. Un ticket invalide est rejeté seul, avec son motif. Si l'écriture
+    reste en conflit après une nouvelle tentative, les tickets valides sont
+    renvoyés « a_renvoyer » : rien n'a été écrit pour eux.
+    """
+    resultats = {}
+    lus = {}
+    for i, brut in enumerate(tickets):
+        try:
+            lus[i] = lire_ticket(brut)
+        except ValueError as e:
+            cle = brut.get('cle') if isinstance(brut, dict) else None
+            resultats[i] = {'cle': cle, 'statut': 'rejete', 'erreur': str(e)}
+    if lus:
+        try:
+            with transaction.atomic():
+                resultats.update(inserer(lus))
+        except (IntegrityError, ValueError):
+            # La même clé vient d'être enregistrée par un envoi concurrent, ou une journée vient d'être
+            # clôturée (cumuler_ventes_journalieres) : on rejoue, doublons et tickets du jour clos sont alors vus
+            try:
+                with transaction.atomic():
+                    resultats.update(inserer(lus))
+            except (IntegrityError, ValueError):
+                # Nouveau conflit : rien n'est écrit, la caisse renverra ces tickets plus tard
+                for i, ticket in lus.items():
+                    resultats[i] = {'cle': ticket['cle'], 'statut': 'a_renvoyer', 'erreur': "Conflit d'écriture, réessayer"}
+    return [resultats[i] for i in range(len(tickets))]
@@ -0,0 +1,116 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import InstantaneStock, MouvementStock, Produit
+
+TAILLE_LOT = 900
+# Bien plus que la durée d'une transaction : tout mouvement daté avant maintenant - MARGE est validé
+MARGE = timedelta(minutes=5)
+
+
+def prendre_instantane():
+    """Nouvel instantané, déduit du précédent et du journal ; renvoie le nombre de produits figés.
+
+    Il est daté de MARGE en arrière : une transaction date ses mouvements
+    avant son commit, lire Produit.stock « maintenant » manquerait un
+    mouvement daté juste avant mais validé juste après, compté alors ni
+    dans l'instantané ni dans les sommes suivantes. Le prix figé est le
+    prix actuel (celui du précédent instantané pour un produit supprimé).
+    À prendre chaque nuit (commande instantane_stock).
+    """
+    moment = timezone.now() - MARGE
+    date_precedente = InstantaneStock.objects.aggregate(date=Max('date'))['date']
+    if date_precedente is not None and date_precedente >= moment:
+        # Le dernier instantané est plus récent : rien à figer de plus
+        return 0
+    stocks, prix = {}, {}
+    if date_precedente is not None:
+        stocks, prix = lire_instantane(date_precedente)
+    # Sans instantané précédent (catalogue vide à la migration), tout le stock est dans le journal
+    ajouter_mouvements(stocks, date_precedente, moment)
+    actuels = dict(Produit.objects.values_list('id', 'prix'))
+    instantanes = [
+        InstantaneStock(
+            produit_id=produit_id if produit_id in actuels else None, id_produit=produit_id, date=moment,
+            stock=stock, prix=actuels.get(produit_id, prix.get(produit_id, Decimal('0'))),
+        )
+        for produit_id, stock in stocks.items()
+        # Un produit supprimé (stock remis à zéro par le journal) n'est plus reporté
+        if produit_id in actuels or stock
+    ]
+    with transaction.atomic():
+        return len(InstantaneStock.objects.bulk_create(instantanes, batch_size=TAILLE_LOT))
+
+
+def par_lots(queryset, champ, ids):
+    """Le queryset filtré sur `champ` IN ids par lots de TAILLE_LOT, ou entier si ids vaut None."""
+    if ids is None:
+        yield queryset
+        return
+    ids = list(ids)
+    for i in range(0, len(ids), TAILLE_LOT):
+        yield queryset.filter(**{f'{champ}__in': ids[i:i + TAILLE_LOT]})
+
+
+def lire_instantane(date, produit_ids=None):
+    """({produit_id: stock}, {produit_id: prix}) de l'instantané pris à `date`."""
+    stocks, prix = {}, {}
+    for lot in par_lots(InstantaneStock.objects.filter(date=date), 'id_produit', produit_ids):
+        for produit_id, stock, prix_fige in lot.values_list('id_produit', 'stock', 'prix'):
+            stocks[produit_id] = stock
+            prix[produit_id] = prix_fige
+    return stocks, prix
+
+
+def ajouter_mouvements(stocks, debut, fin, produit_ids=None):
+    """Ajoute à `stocks` la somme par produit des mouvements datés dans ]debut, fin] (debut None : depuis le début)."""
+    mouvements = MouvementStock.objects.filter(date_mouvement__lte=fin)
+    if debut is not None:
+        mouvements = mouvements.filter(date_mouvement__gt=debut)
+    for lot in par_lots(mouvements, 'id_produit', produit_ids):
+        for produit_id, quantite in lot.values_list('id_produit').annotate(quantite=Sum('quantite')).order_by():
+            stocks[produit_id] = stocks.get(produit_id, 0) + quantite
+
+
+def etat_a_date(moment, produit_ids=None):
+    """(date de l'instantané, {produit_id: stock}, {produit_id: prix}) à l'instant `moment`.
+
+    Dernier instantané antérieur, plus la somme des mouvements survenus
+    entre les deux : un MAX sur l'index (date, id_produit) et deux lectures
+    bornées, quelle que soit la longueur du journal. Un produit créé
+    depuis l'instantané part de zéro (son stock initial est un mouvement)
+    et n'a pas de prix figé. Lève ValueError avant le premier instantané.
+    """
+    date_instantane = InstantaneStock.objects.filter(date__lte=moment).aggregate(date=Max('date'))['date']
+    if date_instantane is None:
+        raise ValueError(f"Aucun instantané de stock au {timezone.localtime(moment):%d/%m/%Y %H:%M}")
+    stocks, prix = lire_instantane(date_instantane, produit_ids)
+    ajouter_mouvements(stocks, date_instantane, moment, produit_ids)
+    return date_instantane, stocks, prix
+
+
+def stock_a_date(moment, produit_ids=None):
+    """{produit_id: stock} à l'instant `moment` (voir etat_a_date)."""
+    return etat_a_date(moment, produit_ids)[1]
+
+
+def inventaire_a_date(moment, produit_ids=None):
+    """Valorisation du stock à l'instant `moment` : unités en stock et valeur au prix de l'instantané.
+
+    Les produits créés depuis l'instantané sont valorisés au prix actuel.
+    """
+    date_instantane, stocks, prix = etat_a_date(moment, produit_ids)
+    sans_prix = [produit_id for produit_id in stocks if produit_id not in prix]
+    for lot in par_lots(Produit.objects.all(), 'id', sans_prix):
+        prix.update(lot.values_list('id', 'prix'))
+    valeur = Decimal('0')
+    unites = 0
+    for produit_id, stock in stocks.items():
+        if stock > 0 and produit_id in prix:
+            valeur += stock * prix[produit_id]
+            unites += stock
+    return {'date': moment, 'instantane': date_instantane, 'unites': unites, 'valeur': valeur, 'stocks': stocks}
@@ -0,0 +1,115 @@
+import random
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+
+from caisse.banc_essai import base_jetable
+from caisse.encaissement import encaisser
+from caisse.models import Produit
+from caisse.panier import calculer_panier, total_panier
+from caisse.stock import remettre_stock, retirer_stock
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le débit d'encaissements simultanés (un thread par caisse) sur une base "
+        "jetable créée comme une base de test : SQLite par défaut, PostgreSQL avec DATABASE_URL"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--caisses', type=int, default=4, help="Nombre de caisses simultanées")
+        parser.add_argument('--tickets', type=int, default=100, help="Tickets encaissés par caisse")
+        parser.add_argument('--articles', type=int, default=3, help="Articles par ticket")
+        parser.add_argument('--produits', type=int, default=500)
+        parser.add_argument('--reconnexion', action='store_true',
+                            help="Ferme la connexion après chaque ticket (comme CONN_MAX_AGE=0)")
+        parser.add_argument('--sans-pragmas', action='store_true',
+                            help="SQLite : journalisation par défaut, sans SQLITE_PRAGMAS")
+
+    def handle(self, *args, **options):
+        reglages = {'SQLITE_PRAGMAS': {}} if options['sans_pragmas'] else {}
+        with base_jetable(**reglages):
+            resultats = self.mesurer(options)
+        self.afficher(resultats, options)
+
+    def mesurer(self, options):
+        ids = [
+            produit.id for produit in Produit.objects.bulk_create(
+                Produit(nom=f"Bench {i}", prix=Decimal('1.50'), stock=10 ** 6)
+                for i in range(options['produits'])
+            )
+        ]
+        resultats = {'latences': [], 'bloques': 0}
+        verrou = threading.Lock()
+        depart = threading.Barrier(options['caisses'] + 1)
+
+        def caisse(numero):
+            hasard = random.Random(numero)
+            latences = []
+            bloques = 0
+            depart.wait()
+            for _ in range(options['tickets']):
+                debut = time.perf_counter()
+                if self.encaisser_ticket(hasard.sample(ids, options['articles'])):
+                    latences.append(time.perf_counter() - debut)
+                else:
+                    bloques += 1
+                if options['reconnexion']:
+                    connection.close()
+            connection.close()
+            with verrou:
+                resultats['latences'].extend(latences)
+                resultats['bloques'] += bloques
+
+        threads = [threading.Thread(target=caisse, args=(numero,)) for numero in range(options['caisses'])]
+        for thread in threads:
+            thread.start()
+        depart.wait()
+        debut = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        resultats['duree'] = time.perf_counter() - debut
+        resultats['base'] = f"{connection.vendor} ({connection.settings_dict['NAME']})"
+        return resultats
+
+    def encaisser_ticket(self, produit_ids):
+        """Un ticket comme à la caisse : réservation du stock article par article, puis paiement."""
+        retires = []
+        try:
+            for produit_id in produit_ids:
+                if retirer_stock(produit_id):
+                    retires.append(produit_id)
+            panier = {str(produit_id): 1 for produit_id in retires}
+            total = total_panier(calculer_panier(panier))
+            encaisser(panier, [('especes', total)])
+            return True
+        except OperationalError:
+            for produit_id in retires:
+                try:
+                    remettre_stock(produit_id)
+                except OperationalError:
+                    pass
+            return False
+
+    def afficher(self, resultats, options):
+        latences = sorted(resultats['latences'])
+        nb = len(latences)
+        self.stdout.write(f"Base : {resultats['base']}")
+        self.stdout.write(
+            f"{options['caisses']} caisses x {options['tickets']} tickets de {options['articles']} articles"
+            f"{' (reconnexion à chaque ticket)' if options['reconnexion'] else ''}"
+            f"{' (sans pragmas)' if options['sans_pragmas'] else ''}"
+        )
+        if not nb:
+            self.stdout.write(self.style.ERROR(f"Aucun ticket encaissé ({resultats['bloques']} bloqués)"))
+            return
+        centiles = statistics.quantiles(latences, n=100) if nb > 1 else [latences[0]] * 99
+        self.stdout.write(self.style.SUCCESS(
+            f"{nb} tickets en {resultats['duree']:.2f} s : {nb / resultats['duree']:.1f} tickets/s, "
+            f"p50 {centiles[49] * 1000:.1f} ms, p95 {centiles[94] * 1000:.1f} ms, "
+            f"{resultats['bloques']} échecs « database is locked »"
+        ))
@@ -0,0 +1,120 @@
+import json
+import subprocess
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from caisse.banc_essai import base_jetable, mesurer
+from caisse.generation import generer
+from caisse.export import executer_export
+from caisse.models import ExportRapport, Produit
+from caisse.panier import CLE_SESSION
+
+
+def commit_courant():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Chronomètre les parcours principaux (caisse, rapports, export, import) sur une base jetable "
+        "remplie de données synthétiques, et écrit les résultats en JSON pour comparer deux commits"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--produits', type=int, default=10000)
+        parser.add_argument('--ventes', type=int, default=100000)
+        parser.add_argument('--remises', type=int, default=5000)
+        parser.add_argument('--reassorts', type=int, default=2000)
+        parser.add_argument('--repetitions', type=int, default=5)
+        parser.add_argument('--lignes-import', type=int, default=1000)
+        parser.add_argument('--sortie', default='benchmark.json', help="Fichier JSON (- pour la sortie standard)")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media, base_jetable(MEDIA_ROOT=media):
+            volumes = generer(
+                produits=options['produits'], ventes=options['ventes'],
+                remises=options['remises'], reassorts=options['reassorts'],
+            )
+            scenarios = self.scenarios(options)
+            base = connection.vendor
+        resultat = {
+            'commit': commit_courant(),
+            'date': timezone.now().isoformat(),
+            'base': base,
+            'volumes': volumes,
+            'repetitions': options['repetitions'],
+            'scenarios': scenarios,
+        }
+        texte = json.dumps(resultat, indent=2, ensure_ascii=False)
+        if options['sortie'] == '-':
+            self.stdout.write(texte)
+        else:
+            with open(options['sortie'], 'w', encoding='utf-8') as fichier:
+                fichier.write(texte + '\n')
+            for nom, mesure in scenarios.items():
+                self.stdout.write(f"{nom:<28} {mesure['mediane_ms']:>10.1f} ms  {mesure['requetes']:>5} requêtes")
+            self.stdout.write(self.style.SUCCESS(f"Résultats écrits dans {options['sortie']}"))
+
+    def scenarios(self, options):
+        client = Client()
+        repetitions = options['repetitions']
+        ids = list(Produit.objects.filter(stock__gte=2 * repetitions).order_by('id').values_list('id', flat=True)[:50])
+        scenarios = {}
+
+        scenarios['caisse_affichage'] = mesurer(lambda: client.get('/caisse/'), repetitions)
+
+        # Parcours de l'interface de caisse : l'API JSON (ligne modifiée seule), pas le formulaire historique
+        def api(chemin, valeurs):
+            reponse = client.post(chemin, valeurs, content_type='application/json')
+            if reponse.status_code != 200:
+                raise RuntimeError(f"{chemin} : {reponse.status_code} {reponse.content[:200]!r}")
+            return reponse
+
+        scenarios['api_ajout'] = mesurer(lambda: api('/api/caisse/ajouter/', {'produit': ids[0]}), repetitions)
+        scenarios['api_retrait'] = mesurer(lambda: api('/api/caisse/retirer/', {'produit': ids[0]}), repetitions)
+
+        def remplir_panier():
+            for produit_id in ids[:3]:
+                api('/api/caisse/ajouter/', {'produit': produit_id})
+
+        def payer():
+            total = client.session[CLE_SESSION]['total']
+            api('/api/caisse/payer/', {'paiements': [{'mode': 'carte', 'montant': total}]})
+
+        scenarios['api_encaissement'] = mesurer(payer, repetitions, preparer=remplir_panier)
+
+        aujourd_hui = timezone.localdate()
+        for jours in (1, 30, 365):
+            periode = {'date_debut': str(aujourd_hui - timedelta(days=jours - 1)), 'date_fin': str(aujourd_hui)}
+            scenarios[f'rapports_{jours}j'] = mesurer(lambda: client.get('/rapports/', periode), repetitions)
+
+        debut_30j = aujourd_hui - timedelta(days=29)
+        scenarios['export_demande'] = mesurer(
+            lambda: client.get('/rapports/', {'date_debut': str(debut_30j), 'export_excel': '1'}), repetitions,
+        )
+        # Le travail du worker, sur un export neuf à chaque répétition
+        scenarios['export_excel_30j'] = mesurer(
+            lambda: executer_export(ExportRapport.objects.create(date_debut=debut_30j, version_donnees='benchmark')),
+            repetitions,
+        )
+
+        lignes = ['nom,prix,stock'] + [f"Import {i},{i % 90 + 1}.50,{i % 40}" for i in range(options['lignes_import'])]
+        contenu = ('\n'.join(lignes) + '\n').encode()
+        scenarios['import_csv'] = mesurer(
+            lambda: client.post('/importer/', {'csv_file': SimpleUploadedFile('produits.csv', contenu)}),
+            repetitions,
+        )
+        return scenarios
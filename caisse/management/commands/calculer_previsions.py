@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from caisse.prevision import calculer_previsions
+
+
+class Command(BaseCommand):
+    help = "Met à jour seuils de réassort et stocks cibles d'après les ventes des jours écoulés (à lancer chaque nuit)"
+
+    def handle(self, *args, **options):
+        nb = calculer_previsions()
+        if nb:
+            self.stdout.write(self.style.SUCCESS(f"{nb} prévisions recalculées"))
+        else:
+            self.stdout.write("Prévisions déjà à jour")
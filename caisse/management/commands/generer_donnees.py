@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from caisse.generation import generer
+
+
+class Command(BaseCommand):
+    help = "Ajoute à la base un jeu de données synthétique (produits, ventes et paiements, remises, réassorts)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--produits', type=int, default=100000)
+        parser.add_argument('--ventes', type=int, default=2000000, help="Ventes, chacune avec un paiement")
+        parser.add_argument('--remises', type=int, default=50000)
+        parser.add_argument('--reassorts', type=int, default=20000)
+        parser.add_argument('--jours', type=int, default=365, help="Période couverte par les ventes")
+        parser.add_argument('--graine', type=int, default=0, help="Graine du générateur aléatoire")
+
+    def handle(self, *args, **options):
+        debut = time.perf_counter()
+        crees = generer(
+            produits=options['produits'], ventes=options['ventes'], remises=options['remises'],
+            reassorts=options['reassorts'], jours=options['jours'], graine=options['graine'],
+        )
+        detail = ', '.join(f"{nb} {modele}" for modele, nb in crees.items())
+        self.stdout.write(self.style.SUCCESS(f"Créés en {time.perf_counter() - debut:.1f} s : {detail}"))
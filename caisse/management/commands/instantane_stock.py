@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from caisse.inventaire import prendre_instantane
+
+
+class Command(BaseCommand):
+    help = "Fige le stock et le prix de chaque produit, point de départ des calculs de stock à date (à lancer chaque nuit)"
+
+    def handle(self, *args, **options):
+        nb = prendre_instantane()
+        self.stdout.write(self.style.SUCCESS(f"Instantané de {nb} produits enregistré"))
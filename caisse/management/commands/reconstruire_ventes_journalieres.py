@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from caisse.agregats import reconstruire_ventes_journalieres
+
+
+class Command(BaseCommand):
+    help = "Recalcule le cumul journalier des ventes (VenteJournaliere) depuis les paiements"
+
+    def handle(self, *args, **options):
+        nb = reconstruire_ventes_journalieres()
+        self.stdout.write(self.style.SUCCESS(f"{nb} lignes journalières recalculées"))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from caisse.export import executer_export, prendre_export, purger_exports
+
+
+class Command(BaseCommand):
+    help = "Worker des exports de rapports : prépare les exports en attente, un par un"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--une-fois', action='store_true', help="Traite les exports en attente puis s'arrête")
+        parser.add_argument('--attente', type=float, default=2.0, help="Secondes entre deux recherches d'exports")
+        parser.add_argument('--conserver-jours', type=int, default=7)
+
+    def handle(self, *args, **options):
+        purger_exports(options['conserver_jours'])
+        while True:
+            close_old_connections()
+            export = prendre_export()
+            if export is not None:
+                export = executer_export(export)
+                self.stdout.write(f"{export} : {export.fichier.name or export.erreur}")
+                continue
+            if options['une_fois']:
+                return
+            time.sleep(options['attente'])
@@ -0,0 +1,211 @@
+import bisect
+import hmac
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates
+
+# Vues suivies (nom d'URL) ; les autres reçoivent l'en-tête Server-Timing sans être agrégées
+VUES_SUIVIES = {
+    'caisse', 'rapports', 'importer_produits',
+    'produits_critiques', 'reassort_produit', 'reassort_auto', 'api_tickets',
+    # API de la caisse, utilisée par l'interface depuis la version JSON
+    'api_ajouter', 'api_retirer', 'api_remise', 'api_payer',
+}
+# Champs POST qui désignent l'action de la vue caisse, dans l'ordre où la vue les teste
+ACTIONS_CAISSE = (
+    'produit', 'ajouter_nouveau', 'supprimer_produit', 'appliquer_remise',
+    'appliquer_remise_article', 'remove_item', 'vider_panier', 'payer',
+)
+BORNES_SECONDES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BORNES_REQUETES = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+QUANTILES = (0.5, 0.95, 0.99)
+
+_mesure = ContextVar('mesure', default=None)
+
+
+class Histogramme:
+    """Histogramme cumulatif à bornes fixes, au format Prometheus."""
+
+    def __init__(self, bornes):
+        self.bornes = bornes
+        self.comptes = [0] * (len(bornes) + 1)
+        self.somme = 0.0
+        self.nombre = 0
+
+    def observer(self, valeur):
+        self.comptes[bisect.bisect_left(self.bornes, valeur)] += 1
+        self.somme += valeur
+        self.nombre += 1
+
+    def quantile(self, q):
+        """Estimation par interpolation linéaire dans le seau qui contient le rang q."""
+        if not self.nombre:
+            return 0.0
+        rang = q * self.nombre
+        cumul = 0
+        for i, compte in enumerate(self.comptes):
+            if compte and cumul + compte >= rang:
+                if i == len(self.bornes):
+                    return self.bornes[-1]
+                bas = self.bornes[i - 1] if i else 0.0
+                return bas + (self.bornes[i] - bas) * (rang - cumul) / compte
+            cumul += compte
+        return self.bornes[-1]
+
+
+class Registre:
+    """Histogrammes par (mesure, vue, action) du processus courant.
+
+    Chaque worker gunicorn a le sien : /metrics décrit le worker qui répond.
+    """
+
+    MESURES = {
+        'duree_secondes': ("Durée totale de la requête", BORNES_SECONDES),
+        'base_secondes': ("Temps passé dans les requêtes SQL", BORNES_SECONDES),
+        'gabarits_secondes': ("Temps de rendu des gabarits", BORNES_SECONDES),
+        'requetes_sql': ("Nombre de requêtes SQL", BORNES_REQUETES),
+    }
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.histogrammes = {}
+
+    def enregistrer(self, vue, action, valeurs):
+        with self.verrou:
+            for nom, valeur in valeurs.items():
+                cle = (nom, vue, action)
+                histogramme = self.histogrammes.get(cle)
+                if histogramme is None:
+                    histogramme = self.histogrammes[cle] = Histogramme(self.MESURES[nom][1])
+                histogramme.observer(valeur)
+
+    def exposition(self):
+        """Texte au format d'exposition Prometheus 0.0.4."""
+        lignes = []
+        with self.verrou:
+            cles = sorted(self.histogrammes)
+            for nom, (aide, bornes) in self.MESURES.items():
+                metrique = f'caisse_{nom}'
+                lignes.append(f'# HELP {metrique} {aide}')
+                lignes.append(f'# TYPE {metrique} histogram')
+                for cle in cles:
+                    if cle[0] != nom:
+                        continue
+                    histogramme = self.histogrammes[cle]
+                    etiquettes = f'vue="{cle[1]}",action="{cle[2]}"'
+                    cumul = 0
+                    for borne, compte in zip(bornes, histogramme.comptes):
+                        cumul += compte
+                        lignes.append(f'{metrique}_bucket{{{etiquettes},le="{borne}"}} {cumul}')
+                    lignes.append(f'{metrique}_bucket{{{etiquettes},le="+Inf"}} {histogramme.nombre}')
+                    lignes.append(f'{metrique}_sum{{{etiquettes}}} {histogramme.somme:.6f}')
+                    lignes.append(f'{metrique}_count{{{etiquettes}}} {histogramme.nombre}')
+            lignes.append('# HELP caisse_duree_quantile_secondes p50/p95/p99 estimés depuis caisse_duree_secondes')
+            lignes.append('# TYPE caisse_duree_quantile_secondes gauge')
+            for cle in cles:
+                if cle[0] != 'duree_secondes':
+                    continue
+                for q in QUANTILES:
+                    valeur = self.histogrammes[cle].quantile(q)
+                    lignes.append(f'caisse_duree_quantile_secondes{{vue="{cle[1]}",action="{cle[2]}",quantile="{q}"}} {valeur:.6f}')
+        return '\n'.join(lignes) + '\n'
+
+
+registre = Registre()
+
+
+class GabaritMesure:
+    """Gabarit du moteur Django dont le rendu est chronométré pour la requête en cours."""
+
+    def __init__(self, gabarit):
+        self.gabarit = gabarit
+
+    def __getattr__(self, nom):
+        return getattr(self.gabarit, nom)
+
+    def render(self, context=None, request=None):
+        mesure = _mesure.get()
+        if mesure is None:
+            return self.gabarit.render(context, request)
+        debut = time.perf_counter()
+        try:
+            return self.gabarit.render(context, request)
+        finally:
+            mesure['gabarits'] += time.perf_counter() - debut
+
+
+class DjangoTemplatesMesures(DjangoTemplates):
+    """Moteur de gabarits des settings (TEMPLATES) : render() et render_to_string() passent par lui."""
+
+    def from_string(self, template_code):
+        return GabaritMesure(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return GabaritMesure(super().get_template(template_name))
+
+
+def action_caisse(request):
+    for champ in ACTIONS_CAISSE:
+        if champ in request.POST:
+            return champ
+    return 'autre'
+
+
+class MetriquesMiddleware:
+    """Mesure chaque requête : nombre et durée des requêtes SQL, rendu des gabarits, durée totale.
+
+    Les mesures partent dans l'en-tête Server-Timing, et sont agrégées dans
+    `registre` pour les vues de VUES_SUIVIES (par action pour les POST de la caisse).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mesure = {'requetes': 0, 'base': 0.0, 'gabarits': 0.0}
+        jeton = _mesure.set(mesure)
+
+        def chronometrer(execute, sql, params, many, context):
+            debut = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                mesure['base'] += time.perf_counter() - debut
+                mesure['requetes'] += 1
+
+        debut = time.perf_counter()
+        try:
+            with connections['default'].execute_wrapper(chronometrer):
+                response = self.get_response(request)
+        finally:
+            _mesure.reset(jeton)
+        duree = time.perf_counter() - debut
+
+        response['Server-Timing'] = (
+            f'db;dur={mesure["base"] * 1000:.1f};desc="{mesure["requetes"]} requetes SQL", '
+            f'tpl;dur={mesure["gabarits"] * 1000:.1f}, total;dur={duree * 1000:.1f}'
+        )
+        vue = request.resolver_match.url_name if request.resolver_match else None
+        if vue in VUES_SUIVIES:
+            action = action_caisse(request) if vue == 'caisse' and request.method == 'POST' else request.method
+            registre.enregistrer(vue, action, {
+                'duree_secondes': duree,
+                'base_secondes': mesure['base'],
+                'gabarits_secondes': mesure['gabarits'],
+                'requetes_sql': mesure['requetes'],
+            })
+        return response
+
+
+def metriques(request):
+    """Exposition Prometheus, réservée au personnel connecté ou à un jeton METRIQUES_JETON (« Authorization: Bearer … »)."""
+    jeton = getattr(settings, 'METRIQUES_JETON', '')
+    autorisation = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (jeton and hmac.compare_digest(autorisation, f'Bearer {jeton}'))):
+        return HttpResponseForbidden()
+    return HttpResponse(registre.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
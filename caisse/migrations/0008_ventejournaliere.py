@@ -0,0 +1,42 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:12
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def remplir_ventes_journalieres(apps, schema_editor):
+    Paiement = apps.get_model('caisse', 'Paiement')
+    VenteJournaliere = apps.get_model('caisse', 'VenteJournaliere')
+    lignes = (
+        Paiement.objects.order_by()
+        .annotate(jour=TruncDate('date_paiement'))
+        .values('jour', 'mode')
+        .annotate(montant=Sum('montant_paye'), nb_tickets=Count('vente', distinct=True))
+    )
+    VenteJournaliere.objects.bulk_create([VenteJournaliere(**ligne) for ligne in lignes], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0007_remove_remise_appliquee_a_remise_appliquee_a_produit_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VenteJournaliere',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jour', models.DateField()),
+                ('mode', models.CharField(max_length=20)),
+                ('montant', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=12)),
+                ('nb_tickets', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('jour', 'mode'), name='vente_journaliere_jour_mode')],
+            },
+        ),
+        migrations.RunPython(remplir_ventes_journalieres, migrations.RunPython.noop),
+    ]
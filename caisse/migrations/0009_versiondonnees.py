@@ -0,0 +1,21 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0008_ventejournaliere'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDonnees',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=50, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0009_versiondonnees'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produit',
+            name='code_barre',
+            field=models.CharField(blank=True, max_length=14, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='produit',
+            name='nom',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
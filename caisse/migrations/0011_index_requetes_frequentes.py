@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0010_produit_code_barre'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paiement',
+            index=models.Index(fields=['date_paiement', 'id'], name='paiement_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paiement',
+            index=models.Index(fields=['mode', 'date_paiement'], name='paiement_mode_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='produit',
+            index=models.Index(fields=['stock'], name='produit_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='remise',
+            index=models.Index(fields=['appliquee_a_produit', 'appliquee_a_vente'], name='remise_produit_vente_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vente',
+            index=models.Index(fields=['date_vente', 'id'], name='vente_date_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0011_index_requetes_frequentes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportRapport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('format', models.CharField(default='xlsx', max_length=10)),
+                ('date_debut', models.DateField(blank=True, null=True)),
+                ('date_fin', models.DateField(blank=True, null=True)),
+                ('version_donnees', models.CharField(max_length=50)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('erreur', 'Erreur')], default='en_attente', max_length=20)),
+                ('progression', models.PositiveSmallIntegerField(default=0)),
+                ('fichier', models.FileField(blank=True, upload_to='exports/')),
+                ('erreur', models.TextField(blank=True)),
+                ('date_demande', models.DateTimeField(default=django.utils.timezone.now)),
+                ('date_fin_traitement', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['format', 'date_debut', 'date_fin', 'version_donnees'], name='export_demande_idx'), models.Index(fields=['statut', 'id'], name='export_statut_idx')],
+            },
+        ),
+    ]
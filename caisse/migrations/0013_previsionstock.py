@@ -0,0 +1,27 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0012_exportrapport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PrevisionStock',
+            fields=[
+                ('produit', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='prevision', serialize=False, to='caisse.produit')),
+                ('vitesse', models.FloatField(default=0)),
+                ('seuil', models.IntegerField()),
+                ('cible', models.IntegerField()),
+                ('jour', models.DateField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['seuil'], name='prevision_seuil_idx')],
+            },
+        ),
+    ]
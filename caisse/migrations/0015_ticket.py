@@ -0,0 +1,101 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:43
+
+from datetime import timedelta
+from decimal import Decimal
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+
+TAILLE_LOT = 1000
+# Au-delà, deux ventes sans paiement consécutives ne viennent pas du même panier
+ECART_MAX = timedelta(minutes=1)
+
+
+def regrouper_tickets(apps, schema_editor):
+    """Reconstitue les tickets de l'historique.
+
+    Un panier encaissé est une suite de ventes d'ids consécutifs, créées au
+    même instant, dont seule la dernière porte les paiements. Une vente
+    restée sans paiement et isolée devient un ticket à elle seule. Le total
+    brut est calculé au prix catalogue actuel, le seul connu.
+    """
+    Vente = apps.get_model('caisse', 'Vente')
+    Paiement = apps.get_model('caisse', 'Paiement')
+    Remise = apps.get_model('caisse', 'Remise')
+    Ticket = apps.get_model('caisse', 'Ticket')
+
+    payes = dict(Paiement.objects.order_by().values_list('vente_id').annotate(montant=Sum('montant_paye')))
+    groupes, en_cours = [], []
+    lignes = Vente.objects.order_by('id').values_list('id', 'date_vente', 'total', 'quantite', 'produit__prix')
+    for ligne in lignes.iterator(chunk_size=TAILLE_LOT):
+        if en_cours and ligne[1] - en_cours[-1][1] > ECART_MAX:
+            groupes.extend([vente] for vente in en_cours)
+            en_cours = []
+        en_cours.append(ligne)
+        if ligne[0] in payes:
+            groupes.append(en_cours)
+            en_cours = []
+    groupes.extend([vente] for vente in en_cours)
+
+    for i in range(0, len(groupes), TAILLE_LOT):
+        lot = groupes[i:i + TAILLE_LOT]
+        tickets = Ticket.objects.bulk_create([
+            Ticket(
+                date_ticket=groupe[-1][1],
+                total=payes.get(groupe[-1][0], sum((vente[2] for vente in groupe), Decimal('0'))),
+                total_brut=sum((vente[4] * vente[3] for vente in groupe), Decimal('0')),
+                nb_articles=sum(vente[3] for vente in groupe),
+            )
+            for groupe in lot
+        ])
+        Vente.objects.bulk_update(
+            [Vente(id=vente[0], ticket_id=ticket.id) for ticket, groupe in zip(tickets, lot) for vente in groupe],
+            ['ticket'], batch_size=TAILLE_LOT,
+        )
+
+    Paiement.objects.update(ticket_id=Subquery(Vente.objects.filter(id=OuterRef('vente_id')).values('ticket_id')[:1]))
+    Remise.objects.filter(appliquee_a_vente__isnull=False).update(
+        ticket_id=Subquery(Vente.objects.filter(id=OuterRef('appliquee_a_vente_id')).values('ticket_id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0014_cloturejournee'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Ticket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_ticket', models.DateTimeField(default=django.utils.timezone.now)),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_brut', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('nb_articles', models.IntegerField()),
+                ('cle', models.CharField(blank=True, max_length=64, null=True, unique=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date_ticket', 'id'], name='ticket_date_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='paiement',
+            name='ticket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='paiements', to='caisse.ticket'),
+        ),
+        migrations.AddField(
+            model_name='remise',
+            name='ticket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='remises', to='caisse.ticket'),
+        ),
+        migrations.AddField(
+            model_name='vente',
+            name='ticket',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lignes', to='caisse.ticket'),
+        ),
+        migrations.RunPython(regrouper_tickets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:47
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0015_ticket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Promotion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=100)),
+                ('type', models.CharField(choices=[('pourcentage', 'Pourcentage'), ('fixe', 'Montant fixe par article'), ('lot', 'N achetés, M payés')], max_length=20)),
+                ('valeur', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=10)),
+                ('achetes', models.PositiveSmallIntegerField(default=0)),
+                ('payes', models.PositiveSmallIntegerField(default=0)),
+                ('debut', models.DateTimeField(blank=True, null=True)),
+                ('fin', models.DateTimeField(blank=True, null=True)),
+                ('heure_debut', models.TimeField(blank=True, null=True)),
+                ('heure_fin', models.TimeField(blank=True, null=True)),
+                ('jours', models.CharField(blank=True, max_length=7)),
+                ('active', models.BooleanField(default=True)),
+                ('produit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='promotions', to='caisse.produit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['active', 'fin'], name='promotion_active_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:49
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def premier_instantane(apps, schema_editor):
+    """Le journal commence ici : le stock actuel de chaque produit sert de point de départ."""
+    Produit = apps.get_model('caisse', 'Produit')
+    InstantaneStock = apps.get_model('caisse', 'InstantaneStock')
+    maintenant = timezone.now()
+    InstantaneStock.objects.bulk_create(
+        (
+            InstantaneStock(produit_id=produit_id, id_produit=produit_id, date=maintenant, stock=stock, prix=prix)
+            for produit_id, stock, prix in Produit.objects.values_list('id', 'stock', 'prix').iterator(chunk_size=1000)
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0016_promotion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstantaneStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField()),
+                ('stock', models.IntegerField()),
+                ('prix', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('id_produit', models.BigIntegerField()),
+                ('produit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='instantanes', to='caisse.produit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['id_produit', 'date'], name='instantane_id_produit_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('date', 'id_produit'), name='instantane_date_id_produit')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MouvementStock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('vente', 'Vente'), ('annulation', 'Article rendu au stock (panier)'), ('retour', 'Retour client'), ('reassort', 'Réassort'), ('ajustement', 'Ajustement manuel'), ('suppression', 'Produit supprimé')], max_length=20)),
+                ('quantite', models.IntegerField()),
+                ('date_mouvement', models.DateTimeField(default=django.utils.timezone.now)),
+                ('id_produit', models.BigIntegerField()),
+                ('produit', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mouvements', to='caisse.produit')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['date_mouvement'], name='mouvement_date_idx'), models.Index(fields=['id_produit', 'date_mouvement'], name='mouvement_id_produit_date_idx')],
+            },
+        ),
+        migrations.RunPython(premier_instantane, migrations.RunPython.noop),
+    ]
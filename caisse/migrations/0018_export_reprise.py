@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0017_journal_stock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportrapport',
+            name='date_prise',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='exportrapport',
+            name='tentatives',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
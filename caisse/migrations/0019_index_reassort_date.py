@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 16:18
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('caisse', '0018_export_reprise'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reassort',
+            index=models.Index(fields=['date_reassort'], name='reassort_date_idx'),
+        ),
+    ]
@@ -1,21 +1,63 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.utils import timezone
 from decimal import Decimal
 
+# Modes proposés à la caisse (inclut le ticket restaurant, absent de Paiement.MODE_CHOICES)
+MODES_PAIEMENT = [
+    ('especes', 'Espèces'),
+    ('carte', 'Carte'),
+    ('cheque', 'Chèque'),
+    ('ticket', 'Ticket Restaurant'),
+]
+
 class Produit(models.Model):
-    nom = models.CharField(max_length=100)
+    nom = models.CharField(max_length=100, db_index=True)
+    code_barre = models.CharField(max_length=14, unique=True, null=True, blank=True)
     prix = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['stock'], name='produit_stock_idx'),
+        ]
+
     def __str__(self):
         return self.nom
 
+class Ticket(models.Model):
+    """En-tête d'une vente : ses lignes (Vente), paiements et remises, avec les totaux stockés.
+
+    `cle` est la clé d'idempotence des tickets reçus par api/caisse/tickets/ :
+    un ticket renvoyé avec une clé déjà connue n'est pas réenregistré.
+    """
+    date_ticket = models.DateTimeField(default=timezone.now)
+    total = models.DecimalField(max_digits=10, decimal_places=2)
+    # Prix catalogue des articles au moment de la vente, avant remises
+    total_brut = models.DecimalField(max_digits=10, decimal_places=2)
+    nb_articles = models.IntegerField()
+    cle = models.CharField(max_length=64, unique=True, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_ticket', 'id'], name='ticket_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"Ticket {self.id} du {self.date_ticket} : {self.total} €"
+
 class Vente(models.Model):
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='lignes', null=True, blank=True)
     produit = models.ForeignKey(Produit, on_delete=models.CASCADE)
     quantite = models.IntegerField()
     date_vente = models.DateTimeField(default=timezone.now)
     total = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_vente', 'id'], name='vente_date_idx'),
+        ]
+
     def __str__(self):
         return f"Vente de {self.quantite} {self.produit.nom} le {self.date_vente}"
 
@@ -28,6 +70,12 @@ class Remise(models.Model):
     valeur = models.DecimalField(max_digits=10, decimal_places=2)
     appliquee_a_produit = models.ForeignKey(Produit, on_delete=models.CASCADE, related_name='remises', null=True, blank=True)
     appliquee_a_vente = models.ForeignKey(Vente, on_delete=models.CASCADE, null=True, blank=True)
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='remises', null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['appliquee_a_produit', 'appliquee_a_vente'], name='remise_produit_vente_idx'),
+        ]
 
     def appliquer(self, montant):
         if self.type == 'pourcentage':
@@ -41,10 +89,17 @@ class Paiement(models.Model):
         ('cheque', 'Chèque'),
     ]
     vente = models.ForeignKey(Vente, on_delete=models.CASCADE, related_name='paiements')
+    ticket = models.ForeignKey(Ticket, on_delete=models.CASCADE, related_name='paiements', null=True, blank=True)
     mode = models.CharField(max_length=20, choices=MODE_CHOICES)
     montant_paye = models.DecimalField(max_digits=10, decimal_places=2)
     date_paiement = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_paiement', 'id'], name='paiement_date_idx'),
+            models.Index(fields=['mode', 'date_paiement'], name='paiement_mode_date_idx'),
+        ]
+
     def __str__(self):
         return f"Paiement {self.mode} pour vente {self.vente.id}"
 
@@ -55,13 +110,222 @@ class Reassort(models.Model):
     stock_apres = models.IntegerField()
     date_reassort = models.DateTimeField(default=timezone.now)
     utilisateur = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True)
-    
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_reassort'], name='reassort_date_idx'),
+        ]
+
     def save(self, *args, **kwargs):
-        self.stock_avant = self.produit.stock
-        self.produit.stock += self.quantite_ajoutee
-        self.stock_apres = self.produit.stock
-        self.produit.save()
-        super().save(*args, **kwargs)
+        if self._state.adding:
+            from .stock import ajouter_stock
+            with transaction.atomic():
+                self.stock_avant, self.stock_apres = ajouter_stock(self.produit_id, self.quantite_ajoutee)
+                self.produit.stock = self.stock_apres
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
     
     def __str__(self):
-        return f"Réassort {self.produit.nom}: +{self.quantite_ajoutee}"
\ No newline at end of file
+        return f"Réassort {self.produit.nom}: +{self.quantite_ajoutee}"
+
+class VenteJournaliere(models.Model):
+    """Cumul des paiements par jour et par mode, tenu à jour à l'encaissement."""
+    jour = models.DateField()
+    mode = models.CharField(max_length=20)
+    montant = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0'))
+    nb_tickets = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['jour', 'mode'], name='vente_journaliere_jour_mode'),
+        ]
+
+    def __str__(self):
+        return f"{self.jour} {self.mode}: {self.montant} € ({self.nb_tickets} tickets)"
+
+
+class VersionDonnees(models.Model):
+    """Compteur incrémenté à chaque modification d'un jeu de données (catalogue, ventes...).
+
+    Sert de clé aux caches : une nouvelle version rend les anciennes entrées inutilisables.
+    """
+    nom = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.nom} v{self.version}"
+
+
+class ExportRapport(models.Model):
+    """Export de rapport préparé en arrière-plan (commande traiter_exports).
+
+    Deux demandes identiques (période, format) sur des données inchangées
+    (même version_donnees) partagent le même fichier.
+    """
+    STATUTS = [
+        ('en_attente', 'En attente'),
+        ('en_cours', 'En cours'),
+        ('termine', 'Terminé'),
+        ('erreur', 'Erreur'),
+    ]
+    format = models.CharField(max_length=10, default='xlsx')
+    date_debut = models.DateField(null=True, blank=True)
+    date_fin = models.DateField(null=True, blank=True)
+    version_donnees = models.CharField(max_length=50)
+    statut = models.CharField(max_length=20, choices=STATUTS, default='en_attente')
+    progression = models.PositiveSmallIntegerField(default=0)
+    fichier = models.FileField(upload_to='exports/', blank=True)
+    erreur = models.TextField(blank=True)
+    date_demande = models.DateTimeField(default=timezone.now)
+    date_fin_traitement = models.DateTimeField(null=True, blank=True)
+    # Prise en charge par un worker, rafraîchie à chaque progression : un export
+    # en cours sans nouvelle depuis trop longtemps a perdu son worker
+    date_prise = models.DateTimeField(null=True, blank=True)
+    tentatives = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['format', 'date_debut', 'date_fin', 'version_donnees'], name='export_demande_idx'),
+            models.Index(fields=['statut', 'id'], name='export_statut_idx'),
+        ]
+
+    def __str__(self):
+        return f"Export {self.format} {self.date_debut or '…'} → {self.date_fin or '…'} ({self.statut})"
+
+
+class PrevisionStock(models.Model):
+    """Seuil de réassort et stock cible d'un produit, déduits de sa vitesse de vente.
+
+    Recalculée par la commande calculer_previsions ; `jour` est le dernier jour
+    de ventes pris en compte.
+    """
+    produit = models.OneToOneField(Produit, on_delete=models.CASCADE, primary_key=True, related_name='prevision')
+    vitesse = models.FloatField(default=0)
+    seuil = models.IntegerField()
+    cible = models.IntegerField()
+    jour = models.DateField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['seuil'], name='prevision_seuil_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.produit_id}: {self.vitesse:.2f}/jour, seuil {self.seuil}, cible {self.cible}"
+
+
+class ClotureJournee(models.Model):
+    """Rapport Z figé d'une journée clôturée : chiffres calculés une fois et PDF archivé."""
+    jour = models.DateField(unique=True)
+    donnees = models.JSONField()
+    pdf = models.FileField(upload_to='clotures/')
+    date_cloture = models.DateTimeField(default=timezone.now)
+    utilisateur = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True)
+
+    def __str__(self):
+        return f"Clôture du {self.jour}"
+
+
+
+class Promotion(models.Model):
+    """Règle de remise récurrente, compilée en mémoire par promotions.moteur_courant().
+
+    Sans produit, la règle porte sur le total du ticket. La fenêtre est
+    facultative : dates de début et de fin, plage horaire (qui peut passer
+    minuit) et jours de la semaine ('0' = lundi ... '6' = dimanche).
+    """
+    TYPE_CHOICES = [
+        ('pourcentage', 'Pourcentage'),
+        ('fixe', 'Montant fixe par article'),
+        ('lot', 'N achetés, M payés'),
+    ]
+    nom = models.CharField(max_length=100)
+    type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    valeur = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0'))
+    produit = models.ForeignKey(Produit, on_delete=models.CASCADE, related_name='promotions', null=True, blank=True)
+    achetes = models.PositiveSmallIntegerField(default=0)
+    payes = models.PositiveSmallIntegerField(default=0)
+    debut = models.DateTimeField(null=True, blank=True)
+    fin = models.DateTimeField(null=True, blank=True)
+    heure_debut = models.TimeField(null=True, blank=True)
+    heure_fin = models.TimeField(null=True, blank=True)
+    jours = models.CharField(max_length=7, blank=True)
+    active = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['active', 'fin'], name='promotion_active_idx'),
+        ]
+
+    def clean(self):
+        if self.type == 'lot' and (self.produit_id is None or not self.achetes > self.payes):
+            raise ValidationError("Un lot porte sur un produit, avec plus d'articles achetés que payés")
+        if self.type == 'pourcentage' and not 0 < self.valeur <= 100:
+            raise ValidationError("Le pourcentage doit être compris entre 0 et 100")
+        if self.type == 'fixe' and not self.valeur > 0:
+            raise ValidationError("Le montant doit être positif")
+        if (self.heure_debut is None) != (self.heure_fin is None):
+            raise ValidationError("Indiquer les deux bornes de la plage horaire, ou aucune")
+        if self.jours.strip('0123456'):
+            raise ValidationError("Jours : chiffres de 0 (lundi) à 6 (dimanche)")
+
+    def __str__(self):
+        return self.nom
+
+
+class MouvementStock(models.Model):
+    """Journal des mouvements de stock, en ajout seul : une ligne par variation de Produit.stock.
+
+    La date est celle de la modification du stock (pour un ticket reçu en
+    différé, celle de sa réception), ce qui garde le journal cohérent avec
+    les instantanés.
+    """
+    TYPES = [
+        ('vente', 'Vente'),
+        ('annulation', 'Article rendu au stock (panier)'),
+        ('retour', 'Retour client'),
+        ('reassort', 'Réassort'),
+        ('ajustement', 'Ajustement manuel'),
+        ('suppression', 'Produit supprimé'),
+    ]
+    # Produit supprimé : le lien passe à NULL, id_produit garde l'historique intact
+    produit = models.ForeignKey(Produit, on_delete=models.SET_NULL, related_name='mouvements', null=True, blank=True)
+    id_produit = models.BigIntegerField()
+    type = models.CharField(max_length=20, choices=TYPES)
+    quantite = models.IntegerField()
+    date_mouvement = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date_mouvement'], name='mouvement_date_idx'),
+            models.Index(fields=['id_produit', 'date_mouvement'], name='mouvement_id_produit_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_type_display()} {self.id_produit}: {self.quantite:+d}"
+
+
+class InstantaneStock(models.Model):
+    """Stock et prix de chaque produit à un instant (commande instantane_stock).
+
+    Le stock à une date se lit dans le dernier instantané antérieur, plus les
+    mouvements survenus depuis.
+    """
+    # Comme pour MouvementStock : supprimer un produit ne réécrit pas les instantanés passés
+    produit = models.ForeignKey(Produit, on_delete=models.SET_NULL, related_name='instantanes', null=True, blank=True)
+    id_produit = models.BigIntegerField()
+    date = models.DateTimeField()
+    stock = models.IntegerField()
+    prix = models.DecimalField(max_digits=10, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'id_produit'], name='instantane_date_id_produit'),
+        ]
+        indexes = [
+            models.Index(fields=['id_produit', 'date'], name='instantane_id_produit_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id_produit} au {self.date}: {self.stock}"
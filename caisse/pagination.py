@@ -0,0 +1,42 @@
+from datetime import datetime
+
+from django.db.models import Q
+
+TAILLE_PAGE = 50
+
+
+def encoder_curseur(date, pk):
+    return f"{date.isoformat()}~{pk}"
+
+
+def decoder_curseur(curseur):
+    """Renvoie (date, id) ou None si le curseur est absent ou illisible."""
+    if not curseur:
+        return None
+    date_str, sep, pk_str = curseur.rpartition('~')
+    if not sep:
+        return None
+    try:
+        return datetime.fromisoformat(date_str), int(pk_str)
+    except ValueError:
+        return None
+
+
+def page_keyset(queryset, champ_date, curseur=None, taille=TAILLE_PAGE):
+    """Page suivante d'un queryset trié par (champ_date, id) décroissants.
+
+    Le curseur désigne la dernière ligne déjà affichée : on reprend juste
+    après elle au lieu d'un OFFSET, donc le coût ne dépend pas de la page.
+    Renvoie (objets, curseur_suivant) ; curseur_suivant vaut None en fin de liste.
+    """
+    queryset = queryset.order_by(f'-{champ_date}', '-id')
+    position = decoder_curseur(curseur)
+    if position:
+        date, pk = position
+        queryset = queryset.filter(Q(**{f'{champ_date}__lt': date}) | Q(**{champ_date: date, 'id__lt': pk}))
+    objets = list(queryset[:taille + 1])
+    if len(objets) <= taille:
+        return objets, None
+    objets = objets[:taille]
+    dernier = objets[-1]
+    return objets, encoder_curseur(getattr(dernier, champ_date), dernier.pk)
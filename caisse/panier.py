@@ -0,0 +1,233 @@
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Produit, Remise
+from .promotions import moteur_courant
+from .versions import CATALOGUE, REMISES, incrementer_version, versions
+
+CLE_SESSION = 'panier_prix'
+
+
+def get_panier_dict(request):
+    panier = request.session.get('panier', {})
+    if not isinstance(panier, dict):
+        panier = {}
+    cleaned_panier = {str(key): int(value) for key, value in panier.items() if isinstance(value, (int, str)) and int(value) > 0}
+    enregistrer_panier(request, cleaned_panier)
+    return cleaned_panier
+
+
+def enregistrer_panier(request, panier):
+    """Écrit le panier en session seulement s'il a changé.
+
+    Une session modifiée est réécrite en base à la fin de la requête : un
+    simple affichage de la caisse ne doit pas en provoquer.
+    """
+    if request.session.get('panier', {}) != panier:
+        request.session['panier'] = panier
+
+
+def appliquer_remises(montant, remises):
+    """Applique dans l'ordre des remises [(type, valeur), ...] sur un montant."""
+    for type_remise, valeur in remises:
+        valeur = Decimal(valeur)
+        deduction = montant * (valeur / 100) if type_remise == 'pourcentage' else valeur
+        montant = max(Decimal('0'), montant - deduction)
+    return montant
+
+
+def invalider_remises():
+    """À appeler quand une remise en attente est créée, modifiée, supprimée ou rattachée à une vente."""
+    incrementer_version(REMISES)
+
+
+def signature_panier(moteur, moment):
+    """[promotions, version du catalogue, version des remises] : un prix tarifé sous une autre signature est périmé.
+
+    Lue avant les données qu'elle couvre : une écriture concurrente donne
+    au pire une signature plus récente, donc un recalcul de plus.
+    """
+    return [moteur.signature(moment), *versions(CATALOGUE, REMISES)]
+
+
+def remises_en_attente(produit_ids):
+    """Une requête : remises non encore rattachées à une vente, pour ces produits et globales."""
+    remises = (
+        Remise.objects.filter(appliquee_a_vente__isnull=True)
+        .filter(Q(appliquee_a_produit__in=produit_ids) | Q(appliquee_a_produit__isnull=True))
+        .order_by('id')
+        .values_list('appliquee_a_produit_id', 'type', 'valeur')
+    )
+    par_produit = {}
+    globales = []
+    for produit_id, type_remise, valeur in remises:
+        remise = [type_remise, str(valeur)]
+        if produit_id is None:
+            globales.append(remise)
+        else:
+            par_produit.setdefault(produit_id, []).append(remise)
+    return par_produit, globales
+
+
+def tarifer_ligne(article, moteur, moment):
+    """Total d'une ligne : promotion en vigueur la plus avantageuse, puis remises manuelles."""
+    prix = Decimal(article['prix'])
+    deduction, article['promotion'] = moteur.remise_ligne(article['produit_id'], prix, article['quantite'], moment)
+    article['total'] = str(appliquer_remises(prix * article['quantite'] - deduction, article['remises']))
+    return article
+
+
+def ligne(produit, quantite, remises, moteur, moment):
+    return tarifer_ligne({
+        'produit_id': produit.id,
+        'nom': produit.nom,
+        'prix': str(produit.prix),
+        'quantite': quantite,
+        'remises': remises,
+    }, moteur, moment)
+
+
+def recalculer_total(prix, moteur, moment, signature=None):
+    total = sum((Decimal(article['total']) for article in prix['lignes'].values()), Decimal('0'))
+    deduction, prix['promotion'] = moteur.remise_total(total, moment)
+    prix['total'] = str(appliquer_remises(total - deduction, prix['remises_globales']))
+    prix['signature'] = signature
+    return prix
+
+
+def calculer_panier(panier, moteur=None, moment=None, signature=None):
+    """Tarifie tout le panier {str_id: quantite} en deux requêtes (in_bulk + remises).
+
+    Les promotions viennent du moteur compilé du processus, sans requête.
+    Le prix gardé en session porte la signature lue avant le calcul.
+    """
+    moteur, moment = moteur or moteur_courant(), moment or timezone.now()
+    ids = []
+    for str_id in panier:
+        try:
+            ids.append(int(str_id))
+        except ValueError:
+            pass
+    produits = Produit.objects.in_bulk(ids)
+    par_produit, globales = remises_en_attente(list(produits))
+    lignes = {}
+    for str_id, quantite in panier.items():
+        produit = produits.get(int(str_id)) if str_id.isdigit() else None
+        if produit is not None:
+            lignes[str_id] = ligne(produit, quantite, par_produit.get(produit.id, []), moteur, moment)
+    return recalculer_total({'lignes': lignes, 'remises_globales': globales}, moteur, moment, signature)
+
+
+def a_jour(prix, panier, signature):
+    """Le prix en session correspond-il au panier, aux prix, aux remises et aux promotions en vigueur ?"""
+    return prix is not None and prix.get('signature') == signature and all(
+        str_id in prix['lignes'] and prix['lignes'][str_id]['quantite'] == quantite
+        for str_id, quantite in panier.items()
+    ) and len(prix['lignes']) == len(panier)
+
+
+def retirer_inconnus(request, panier, prix):
+    """Retire du panier (en place et en session) les produits supprimés depuis leur ajout, absents du prix.
+
+    Sans cela le panier ne serait plus jamais à jour : recalculé et réécrit en session à chaque affichage.
+    """
+    inconnus = [str_id for str_id in panier if str_id not in prix['lignes']]
+    if inconnus:
+        for str_id in inconnus:
+            del panier[str_id]
+        request.session['panier'] = dict(panier)
+
+
+def prix_panier(request, panier):
+    """Renvoie le panier tarifé gardé en session, recalculé seulement s'il ne correspond plus au panier."""
+    moteur, moment = moteur_courant(), timezone.now()
+    signature = signature_panier(moteur, moment)
+    prix = request.session.get(CLE_SESSION)
+    if not a_jour(prix, panier, signature):
+        prix = calculer_panier(panier, moteur, moment, signature)
+        retirer_inconnus(request, panier, prix)
+        # Panier vide jamais tarifé : rien à garder, pas de session créée pour un simple affichage
+        if panier or CLE_SESSION in request.session:
+            request.session[CLE_SESSION] = prix
+    return prix
+
+
+def prix_panier_sans_controle(request):
+    return request.session.get(CLE_SESSION) or {'lignes': {}, 'remises_globales': [], 'total': '0'}
+
+
+def maj_ligne(request, panier, str_id, produit=None):
+    """Recalcule la seule ligne str_id après ajout/retrait, puis le total.
+
+    Sans produit, la ligne est recalculée depuis le prix déjà en session.
+    """
+    moteur, moment = moteur_courant(), timezone.now()
+    signature = signature_panier(moteur, moment)
+    prix = prix_panier_sans_controle(request)
+    if not prix['lignes']:
+        # Un panier vide est à jour quels que soient les prix, remises et promotions
+        prix['signature'] = signature
+    quantite = panier.get(str_id, 0)
+    ancienne = prix['lignes'].get(str_id)
+    if quantite <= 0:
+        prix['lignes'].pop(str_id, None)
+    elif ancienne is not None:
+        ancienne['quantite'] = quantite
+        if produit is not None:
+            ancienne['nom'] = produit.nom
+            ancienne['prix'] = str(produit.prix)
+        tarifer_ligne(ancienne, moteur, moment)
+    elif produit is not None:
+        remises = [
+            [type_remise, str(valeur)]
+            for type_remise, valeur in Remise.objects.filter(appliquee_a_produit=produit, appliquee_a_vente__isnull=True)
+            .order_by('id').values_list('type', 'valeur')
+        ]
+        prix['lignes'][str_id] = ligne(produit, quantite, remises, moteur, moment)
+    # Conserve l'ordre du panier (les actions par index en dépendent)
+    prix['lignes'] = {k: prix['lignes'][k] for k in panier if k in prix['lignes']}
+    if not a_jour(prix, panier, signature):
+        prix = calculer_panier(panier, moteur, moment, signature)
+        retirer_inconnus(request, panier, prix)
+    request.session[CLE_SESSION] = recalculer_total(prix, moteur, moment, signature)
+    return prix
+
+
+def ajouter_remise(request, panier, type_remise, valeur, str_id=None):
+    """Crée la remise sur la ligne str_id (ou globale) et la reporte sur le prix en session sans tout recalculer.
+
+    Si une autre écriture s'est glissée depuis la lecture de la signature,
+    le panier est recalculé (il inclut alors la nouvelle remise).
+    """
+    prix = prix_panier(request, panier)
+    Remise.objects.create(type=type_remise, valeur=valeur, appliquee_a_produit_id=None if str_id is None else int(str_id))
+    moteur, moment = moteur_courant(), timezone.now()
+    signature = signature_panier(moteur, moment)
+    promotions, version_catalogue, version_remises = prix['signature']
+    if signature != [promotions, version_catalogue, version_remises + 1]:
+        prix = calculer_panier(panier, moteur, moment, signature)
+    else:
+        remise = [type_remise, str(valeur)]
+        if str_id is None:
+            prix['remises_globales'].append(remise)
+        elif str_id in prix['lignes']:
+            article = prix['lignes'][str_id]
+            article['remises'].append(remise)
+            tarifer_ligne(article, moteur, moment)
+        prix = recalculer_total(prix, moteur, moment, signature)
+    request.session[CLE_SESSION] = prix
+    return prix
+
+
+def vider(request):
+    request.session.pop(CLE_SESSION, None)
+
+
+def lignes_panier(prix):
+    return list(prix['lignes'].values())
+
+
+def total_panier(prix):
+    return Decimal(prix['total'])
@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import F, FloatField, Max, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .agregats import debut_de_journee, fin_de_journee
+from .models import PrevisionStock, Produit, Vente
+from .stock import reassort_en_masse
+
+FENETRE = 28  # jours : moyenne mobile exponentielle de même centre de gravité qu'une moyenne sur 28 jours
+HISTORIQUE = 3 * FENETRE  # jours relus au premier calcul
+DELAI_LIVRAISON = 3
+JOURS_SECURITE = 2
+JOURS_COUVERTURE = 14
+SEUIL_MIN = 1
+# Produits sans prévision (créés depuis le dernier calcul)
+SEUIL_DEFAUT = 5
+CIBLE_DEFAUT = 20
+TAILLE_LOT = 5000
+
+
+def ventes_par_jour(debut, fin):
+    """(produit_id, jour, quantite) des jours debut à fin inclus, en un GROUP BY."""
+    return (
+        Vente.objects.filter(date_vente__gte=debut_de_journee(debut), date_vente__lt=fin_de_journee(fin))
+        .annotate(jour=TruncDate('date_vente'))
+        .values_list('produit_id', 'jour')
+        .annotate(quantite=Sum('quantite'))
+        .order_by()
+    )
+
+
+def calculer_previsions(jusqu_au=None):
+    """Met à jour vitesse, seuil et cible de tous les produits jusqu'au jour `jusqu_au` (hier par défaut).
+
+    Incrémental : seules les ventes des jours postérieurs au dernier calcul
+    sont relues. La vitesse est une moyenne mobile exponentielle, qui se met
+    à jour sans l'historique : v = v * (1 - a)^n + somme des q_k * a * (1 - a)^(n - 1 - k)
+    pour les n nouveaux jours. Le calcul est vectorisé (pandas/numpy) sur
+    tous les produits à la fois. Renvoie le nombre de prévisions écrites.
+    """
+    import numpy as np
+    import pandas as pd
+
+    fin = jusqu_au or timezone.localdate() - timedelta(days=1)
+    dernier = PrevisionStock.objects.aggregate(jour=Max('jour'))['jour']
+    debut = dernier + timedelta(days=1) if dernier else fin - timedelta(days=HISTORIQUE - 1)
+    if debut > fin:
+        return 0
+
+    ids = pd.Index(Produit.objects.order_by('id').values_list('id', flat=True), name='produit_id')
+    anciennes = pd.DataFrame.from_records(
+        PrevisionStock.objects.values_list('produit_id', 'vitesse'), columns=['produit_id', 'vitesse'],
+    ).set_index('produit_id')['vitesse']
+    vitesse = anciennes.reindex(ids, fill_value=0.0).to_numpy(dtype=float)
+
+    alpha = 2 / (FENETRE + 1)
+    nb_jours = (fin - debut).days + 1
+    poids = alpha * (1 - alpha) ** np.arange(nb_jours - 1, -1, -1)
+    ventes = pd.DataFrame.from_records(ventes_par_jour(debut, fin), columns=['produit_id', 'jour', 'quantite'])
+    if not ventes.empty:
+        rang = ventes['jour'].map(lambda jour: (jour - debut).days).to_numpy()
+        ventes['apport'] = ventes['quantite'].to_numpy(dtype=float) * poids[rang]
+        apports = ventes.groupby('produit_id')['apport'].sum().reindex(ids, fill_value=0.0).to_numpy()
+    else:
+        apports = np.zeros(len(ids))
+    vitesse = vitesse * (1 - alpha) ** nb_jours + apports
+
+    seuil = np.maximum(np.ceil(vitesse * (DELAI_LIVRAISON + JOURS_SECURITE)), SEUIL_MIN).astype(int)
+    cible = np.maximum(seuil + np.ceil(vitesse * JOURS_COUVERTURE).astype(int), seuil + 1)
+    jour = connection.ops.adapt_datefield_value(fin)
+    lignes = [
+        (produit_id, round(v, 4), s, c, jour)
+        for produit_id, v, s, c in zip(ids.tolist(), vitesse.tolist(), seuil.tolist(), cible.tolist())
+    ]
+    with transaction.atomic():
+        PrevisionStock.objects.all().delete()
+        ecrire_previsions(lignes)
+    return len(lignes)
+
+
+def ecrire_previsions(lignes):
+    """INSERT par executemany : pour 100k lignes, bulk_create passe l'essentiel de son temps
+    à préparer les instances, alors qu'on a déjà des tuples prêts."""
+    table = connection.ops.quote_name(PrevisionStock._meta.db_table)
+    colonnes = ', '.join(
+        connection.ops.quote_name(PrevisionStock._meta.get_field(nom).column)
+        for nom in ('produit', 'vitesse', 'seuil', 'cible', 'jour')
+    )
+    sql = f"INSERT INTO {table} ({colonnes}) VALUES (%s, %s, %s, %s, %s)"
+    with connection.cursor() as cursor:
+        for i in range(0, len(lignes), TAILLE_LOT):
+            cursor.executemany(sql, lignes[i:i + TAILLE_LOT])
+
+
+def a_reassortir():
+    """Produits dont le stock est au plus leur seuil de réassort, avec seuil, cible et vitesse annotés.
+
+    Le pré-filtre stock <= plus grand seuil passe par l'index sur stock ; la
+    comparaison au seuil propre à chaque produit ne porte que sur ces lignes.
+    """
+    seuil_max = max(SEUIL_DEFAUT, PrevisionStock.objects.aggregate(seuil=Max('seuil'))['seuil'] or 0)
+    return (
+        Produit.objects.filter(stock__lte=seuil_max)
+        .annotate(
+            seuil=Coalesce('prevision__seuil', Value(SEUIL_DEFAUT)),
+            cible=Coalesce('prevision__cible', Value(CIBLE_DEFAUT)),
+            vitesse=Coalesce('prevision__vitesse', Value(0.0), output_field=FloatField()),
+        )
+        .filter(stock__lte=F('seuil'))
+        .order_by('stock', 'nom')
+    )
+
+
+def reassort_previsionnel(utilisateur=None):
+    """Remonte chaque produit à réassortir à son stock cible."""
+    quantites = {
+        produit_id: cible - stock
+        for produit_id, stock, cible in a_reassortir().values_list('id', 'stock', 'cible')
+        if cible > stock
+    }
+    return reassort_en_masse(quantites, utilisateur)
@@ -0,0 +1,157 @@
+import hashlib
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Promotion
+from .versions import PROMOTIONS, incrementer_version, version
+
+CENTIME = Decimal('0.01')
+ZERO = Decimal('0')
+# Délai maximal avant qu'un processus voie une promotion modifiée depuis un autre
+VERIFICATION_SECONDES = 2
+
+Fenetre = namedtuple('Fenetre', 'debut fin heure_debut heure_fin jours')
+Regle = namedtuple('Regle', 'id nom type valeur achetes payes fenetre')
+
+_moteur = {'moteur': None, 'verifie_le': 0.0}
+_verrou = threading.Lock()
+
+
+def invalider_promotions():
+    incrementer_version(PROMOTIONS)
+    # Ce processus-ci recompile tout de suite, sans attendre VERIFICATION_SECONDES
+    _moteur['moteur'] = None
+
+
+def ouverte(fenetre, moment, local):
+    """La fenêtre (dates, jours, plage horaire) contient-elle cet instant ? `local` : moment en heure locale."""
+    if (fenetre.debut and moment < fenetre.debut) or (fenetre.fin and moment >= fenetre.fin):
+        return False
+    if fenetre.jours and str(local.weekday()) not in fenetre.jours:
+        return False
+    if fenetre.heure_debut is not None:
+        heure = local.time()
+        if fenetre.heure_debut <= fenetre.heure_fin:
+            return fenetre.heure_debut <= heure < fenetre.heure_fin
+        return heure >= fenetre.heure_debut or heure < fenetre.heure_fin
+    return True
+
+
+def deduction_ligne(regle, prix, quantite):
+    if regle.type == 'pourcentage':
+        return prix * quantite * regle.valeur / 100
+    if regle.type == 'fixe':
+        return min(regle.valeur, prix) * quantite
+    # lot : chaque groupe complet de `achetes` articles n'en fait payer que `payes`
+    return (quantite // regle.achetes) * (regle.achetes - regle.payes) * prix
+
+
+def deduction_total(regle, total):
+    if regle.type == 'pourcentage':
+        return total * regle.valeur / 100
+    return min(regle.valeur, total)
+
+
+def meilleure(regles, moment, deduction):
+    """(montant, nom) de la règle en vigueur la plus avantageuse ; (0, None) s'il n'y en a pas."""
+    montant, nom = ZERO, None
+    local = timezone.localtime(moment)
+    for regle in regles:
+        if ouverte(regle.fenetre, moment, local):
+            valeur = Decimal(deduction(regle)).quantize(CENTIME)
+            if valeur > montant:
+                montant, nom = valeur, regle.nom
+    return montant, nom
+
+
+class Moteur:
+    """Promotions actives compilées : listes de règles par produit, et règles sur le total.
+
+    Les promotions ne se cumulent pas : sur chaque ligne (puis sur le total)
+    seule la plus avantageuse en vigueur s'applique. Aucune requête ici.
+    Les fenêtres distinctes sont gardées à part : des milliers de règles
+    n'en partagent en général que quelques-unes.
+    """
+
+    def __init__(self, version_regles, regles, depuis):
+        self.version = version_regles
+        # Les règles terminées avant cet instant n'ont pas été chargées
+        self.depuis = depuis
+        self.par_produit = {}
+        self.globales = []
+        self.fenetres = list(dict.fromkeys(regle.fenetre for _, regle in regles))
+        for produit_id, regle in regles:
+            if produit_id is None:
+                self.globales.append(regle)
+            else:
+                self.par_produit.setdefault(produit_id, []).append(regle)
+
+    def remise_ligne(self, produit_id, prix, quantite, moment):
+        regles = self.par_produit.get(produit_id)
+        if not regles:
+            return ZERO, None
+        return meilleure(regles, moment, lambda regle: deduction_ligne(regle, prix, quantite))
+
+    def remise_total(self, total, moment):
+        return meilleure(self.globales, moment, lambda regle: deduction_total(regle, total))
+
+    def signature(self, moment):
+        """Version des règles et état de chaque fenêtre : change aussi quand une fenêtre s'ouvre ou se ferme.
+
+        Un panier tarifé sous une autre signature doit être recalculé.
+        """
+        local = timezone.localtime(moment)
+        etats = ''.join('1' if ouverte(fenetre, moment, local) else '0' for fenetre in self.fenetres)
+        return f"{self.version}:{hashlib.md5(etats.encode()).hexdigest()}"
+
+
+def compiler(version_regles, depuis=None):
+    """Une requête : les promotions actives non terminées à l'instant `depuis` (maintenant par défaut), rangées par produit."""
+    depuis = depuis or timezone.now()
+    lignes = (
+        Promotion.objects.filter(active=True)
+        .filter(Q(fin__isnull=True) | Q(fin__gt=depuis))
+        .order_by('id')
+        .values_list('produit_id', 'id', 'nom', 'type', 'valeur', 'achetes', 'payes', *Fenetre._fields)
+    )
+    return Moteur(version_regles, [
+        (produit_id, Regle(*champs[:6], Fenetre(*champs[6:])))
+        for produit_id, *champs in lignes
+    ], depuis)
+
+
+def moteur_courant():
+    """Moteur du processus, recompilé seulement quand la version 'promotions' a changé.
+
+    La version n'est relue qu'au plus une fois toutes les VERIFICATION_SECONDES :
+    tarifer un panier ne coûte en général aucune requête.
+    """
+    horloge = time.monotonic()
+    moteur = _moteur['moteur']
+    if moteur is not None and horloge - _moteur['verifie_le'] < VERIFICATION_SECONDES:
+        return moteur
+    version_courante = version(PROMOTIONS)
+    with _verrou:
+        moteur = _moteur['moteur']
+        if moteur is None or moteur.version != version_courante:
+            moteur = compiler(version_courante)
+        _moteur.update(moteur=moteur, verifie_le=horloge)
+    return moteur
+
+
+def moteur_depuis(depuis):
+    """Moteur valable pour des ventes datées à partir de `depuis` (tickets reçus en différé).
+
+    Le moteur du processus suffit si `depuis` est postérieur à sa compilation ;
+    sinon une compilation ponctuelle recharge aussi les promotions terminées depuis.
+    """
+    moteur = moteur_courant()
+    if depuis >= moteur.depuis:
+        return moteur
+    return compiler(moteur.version, depuis)
+
@@ -0,0 +1,81 @@
+import bisect
+import heapq
+import threading
+import unicodedata
+
+from .models import Produit
+from .versions import incrementer_version, version
+
+RECHERCHE = 'recherche'
+LIMITE = 20
+
+_index = {'version': None, 'mots': [], 'noms': {}}
+_verrou = threading.Lock()
+
+
+def normaliser(texte):
+    """Minuscules sans accents : « Été » et « ete » donnent la même clé."""
+    texte = unicodedata.normalize('NFKD', texte.lower())
+    return ''.join(c for c in texte if not unicodedata.combining(c))
+
+
+def invalider_recherche():
+    incrementer_version(RECHERCHE)
+
+
+def construire_index():
+    """Liste triée (mot, id) de tous les mots de tous les noms, pour une recherche par préfixe en bisect."""
+    mots = []
+    noms = {}
+    for produit_id, nom in Produit.objects.values_list('id', 'nom').iterator(chunk_size=5000):
+        noms[produit_id] = normaliser(nom)
+        for mot in set(noms[produit_id].split()):
+            mots.append((mot, produit_id))
+    mots.sort()
+    return mots, noms
+
+
+def index_courant():
+    """Index du processus, reconstruit seulement quand la version 'recherche' a changé.
+
+    La version n'est pas touchée par les mouvements de stock : une vente ne
+    force pas la reconstruction.
+    """
+    version_courante = version(RECHERCHE)
+    if _index['version'] != version_courante:
+        with _verrou:
+            if _index['version'] != version_courante:
+                mots, noms = construire_index()
+                _index.update(version=version_courante, mots=mots, noms=noms)
+    return _index
+
+
+def ids_par_prefixe(mots, prefixe):
+    ids = set()
+    debut = bisect.bisect_left(mots, (prefixe,))
+    for mot, produit_id in mots[debut:]:
+        if not mot.startswith(prefixe):
+            break
+        ids.add(produit_id)
+    return ids
+
+
+def rechercher(texte, limite=LIMITE):
+    """Produits dont chaque mot de `texte` est le début d'un mot du nom.
+
+    Ex. « cho noi » trouve « Chocolat noir 70% ». Renvoie au plus `limite`
+    produits, triés par nom, avec une seule requête pour leurs détails.
+    """
+    termes = normaliser(texte).split()
+    if not termes:
+        return []
+    index = index_courant()
+    ids = None
+    for terme in sorted(termes, key=len, reverse=True):
+        trouves = ids_par_prefixe(index['mots'], terme)
+        ids = trouves if ids is None else ids & trouves
+        if not ids:
+            return []
+    retenus = heapq.nsmallest(limite, ids, key=index['noms'].__getitem__)
+    produits = Produit.objects.in_bulk(retenus)
+    return [produits[produit_id] for produit_id in retenus if produit_id in produits]
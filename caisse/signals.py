@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .agregats import decompter_ventes_journalieres
+from .catalogue import invalider_catalogue
+from .models import Paiement, Produit, Promotion, Remise
+from .panier import invalider_remises
+from .promotions import invalider_promotions
+from .recherche import invalider_recherche
+from .stock import tracer
+
+
+@receiver(post_save, sender=Produit)
+@receiver(post_delete, sender=Produit)
+def produit_modifie(sender, **kwargs):
+    invalider_catalogue()
+    invalider_recherche()
+
+
+@receiver(pre_delete, sender=Produit)
+def produit_supprime(sender, instance, **kwargs):
+    # Le stock restant sort du journal : la somme des mouvements retombe à zéro
+    tracer([(instance.id, 'suppression', -instance.stock)])
+    # Ses ventes et leurs paiements partent en cascade : le cumul journalier les perd aussi
+    decompter_ventes_journalieres(Paiement.objects.filter(vente__produit=instance))
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def promotion_modifiee(sender, **kwargs):
+    invalider_promotions()
+
+
+@receiver(post_save, sender=Remise)
+@receiver(post_delete, sender=Remise)
+def remise_modifiee(sender, **kwargs):
+    invalider_remises()
+
+
+@receiver(connection_created)
+def regler_sqlite(sender, connection, **kwargs):
+    """Applique settings.SQLITE_PRAGMAS à chaque nouvelle connexion SQLite (sans WAL si SQLITE_SANS_WAL)."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    if getattr(settings, 'SQLITE_SANS_WAL', False):
+        pragmas.pop('journal_mode', None)
+    with connection.cursor() as cursor:
+        for nom, valeur in pragmas.items():
+            cursor.execute(f'PRAGMA {nom} = {valeur}')
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import MouvementStock, Produit, Reassort
+
+TAILLE_LOT = 900
+# Trois paramètres par produit dans un UPDATE ... CASE : le lot reste sous la limite de SQLite
+TAILLE_LOT_CASE = 300
+
+
+def tracer(mouvements, moment=None):
+    """Ajoute [(produit_id, type, quantite), ...] au journal des mouvements en un bulk_create.
+
+    À appeler dans la transaction qui modifie Produit.stock.
+    """
+    moment = moment or timezone.now()
+    return MouvementStock.objects.bulk_create([
+        MouvementStock(produit_id=produit_id, id_produit=produit_id, type=type_mouvement, quantite=quantite,
+                       date_mouvement=moment)
+        for produit_id, type_mouvement, quantite in mouvements
+        if quantite
+    ], batch_size=TAILLE_LOT)
+
+
+def retirer_stock(produit_id, quantite=1):
+    """Décrémente le stock seulement s'il reste assez d'unités.
+
+    Un seul UPDATE conditionnel (stock = stock - n WHERE stock >= n) : deux
+    caisses sur le même produit ne peuvent ni perdre une mise à jour ni
+    vendre une unité absente. Renvoie True si le stock a été décrémenté.
+    """
+    with transaction.atomic():
+        if not Produit.objects.filter(id=produit_id, stock__gte=quantite).update(stock=F('stock') - quantite):
+            return False
+        tracer([(produit_id, 'vente', -quantite)])
+    return True
+
+
+def remettre_stock(produit_id, quantite=1, type_mouvement='annulation'):
+    with transaction.atomic():
+        if not Produit.objects.filter(id=produit_id).update(stock=F('stock') + quantite):
+            return False
+        tracer([(produit_id, type_mouvement, quantite)])
+    return True
+
+
+def remettre_stocks(quantites, type_mouvement='annulation'):
+    """Ré-incrémente plusieurs produits {produit_id: quantite} en quelques UPDATE, tracés dans le journal.
+
+    Un seul UPDATE ... SET stock = stock + CASE id ... END WHERE id IN (...)
+    par lot de TAILLE_LOT_CASE identifiants, quelles que soient les
+    quantités. Les mouvements partent en un bulk_create ; les ids inconnus
+    (produit supprimé depuis) ne sont relus que si l'UPDATE en a ignoré.
+    """
+    quantites = {int(produit_id): quantite for produit_id, quantite in quantites.items() if quantite}
+    ids = list(quantites)
+    mouvements = []
+    with transaction.atomic():
+        for i in range(0, len(ids), TAILLE_LOT_CASE):
+            lot = ids[i:i + TAILLE_LOT_CASE]
+            increment = Case(*[When(id=produit_id, then=Value(quantites[produit_id])) for produit_id in lot],
+                             output_field=IntegerField())
+            if Produit.objects.filter(id__in=lot).update(stock=F('stock') + increment) != len(lot):
+                lot = Produit.objects.filter(id__in=lot).values_list('id', flat=True)
+            mouvements += [(produit_id, type_mouvement, quantites[produit_id]) for produit_id in lot]
+        tracer(mouvements)
+    return len(mouvements)
+
+
+def retirer_stocks(quantites):
+    """Décrémente sans condition plusieurs produits {produit_id: quantite} (voir remettre_stocks).
+
+    Réservé aux ventes déjà conclues (tickets reçus en différé) : la
+    marchandise est partie, le stock peut donc passer sous zéro.
+    """
+    return remettre_stocks({produit_id: -quantite for produit_id, quantite in quantites.items()}, 'vente')
+
+
+def ajouter_stock(produit_id, quantite):
+    """Incrémente le stock et renvoie (stock_avant, stock_apres).
+
+    La relecture se fait dans la même transaction que l'UPDATE, qui garde la
+    ligne verrouillée jusqu'au commit : les deux valeurs sont cohérentes.
+    """
+    with transaction.atomic():
+        Produit.objects.filter(id=produit_id).update(stock=F('stock') + quantite)
+        tracer([(produit_id, 'reassort', quantite)])
+        stock_apres = Produit.objects.values_list('stock', flat=True).get(id=produit_id)
+    return stock_apres - quantite, stock_apres
+
+
+def reassort_en_masse(quantites, utilisateur=None):
+    """Réassortit {produit_id: quantite} et trace chaque produit dans Reassort.
+
+    Un UPDATE par lot (voir remettre_stocks), une relecture des stocks dans
+    la même transaction (les lignes modifiées restent verrouillées), puis un
+    bulk_create des Reassort : le nombre de requêtes ne dépend que du nombre
+    de lots.
+    """
+    quantites = {int(produit_id): quantite for produit_id, quantite in quantites.items() if quantite > 0}
+    if not quantites:
+        return []
+    ids = list(quantites)
+    with transaction.atomic():
+        remettre_stocks(quantites, 'reassort')
+        stocks = {}
+        for i in range(0, len(ids), TAILLE_LOT):
+            stocks.update(Produit.objects.filter(id__in=ids[i:i + TAILLE_LOT]).values_list('id', 'stock'))
+        maintenant = timezone.now()
+        reassorts = [
+            Reassort(
+                produit_id=produit_id,
+                quantite_ajoutee=quantite,
+                stock_avant=stocks[produit_id] - quantite,
+                stock_apres=stocks[produit_id],
+                date_reassort=maintenant,
+                utilisateur=utilisateur,
+            )
+            for produit_id, quantite in quantites.items()
+            if produit_id in stocks
+        ]
+        return Reassort.objects.bulk_create(reassorts, batch_size=TAILLE_LOT)
+
+
+def reassort_automatique(seuil, cible, utilisateur=None):
+    """Remonte à `cible` tous les produits dont le stock est <= `seuil`.
+
+    Les quantités à ajouter sont calculées en une seule requête.
+    """
+    quantites = dict(
+        Produit.objects.filter(stock__lte=seuil, stock__lt=cible)
+        .annotate(a_ajouter=Value(cible) - F('stock'))
+        .values_list('id', 'a_ajouter')
+    )
+    return reassort_en_masse(quantites, utilisateur)
@@ -0,0 +1,32 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import VersionDonnees
+
+CATALOGUE = 'catalogue'
+# Incrémentée à chaque écriture du cumul journalier (VenteJournaliere)
+VENTES = 'ventes'
+PROMOTIONS = 'promotions'
+# Incrémentée à chaque création, modification ou consommation d'une remise en attente
+REMISES = 'remises'
+
+
+def version(nom):
+    return VersionDonnees.objects.filter(nom=nom).values_list('version', flat=True).first() or 0
+
+
+def versions(*noms):
+    """Versions de plusieurs noms, dans l'ordre donné, en une requête."""
+    lues = dict(VersionDonnees.objects.filter(nom__in=noms).values_list('nom', 'version'))
+    return [lues.get(nom, 0) for nom in noms]
+
+
+def incrementer_version(nom):
+    """Passe `nom` à la version suivante (dans la transaction courante s'il y en a une)."""
+    if VersionDonnees.objects.filter(nom=nom).update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            VersionDonnees.objects.create(nom=nom, version=1)
+    except IntegrityError:
+        VersionDonnees.objects.filter(nom=nom).update(version=F('version') + 1)
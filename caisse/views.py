@@ -1,205 +1,200 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse
 from decimal import Decimal, InvalidOperation
-from .models import Produit, Vente, Remise, Paiement, Reassort
+from .models import Produit, Vente, Remise, Paiement, Reassort, ExportRapport, ClotureJournee, Ticket, MODES_PAIEMENT
 from .forms import VenteForm
+from .importation import importer_csv, valider_ligne
+from .export import CONTENT_TYPE_XLSX, demander_export
+from .pagination import page_keyset
+from .catalogue import LIMITE_STOCKS, SEUIL_ALERTE, grille_catalogue
+from .encaissement import encaisser
+from .stock import remettre_stock, remettre_stocks, retirer_stock, tracer
+from .prevision import SEUIL_DEFAUT, a_reassortir, reassort_previsionnel
+from .panier import get_panier_dict, ajouter_remise, enregistrer_panier, lignes_panier, maj_ligne, prix_panier, total_panier, vider
+from .agregats import agreger_jours, ca_par_jour_cumule, paiements_entre, stats_tickets, tickets_entre, total_du_jour, ventes_entre
+from .graphique import PERIODES, graphique_ca
+from .cloture import cloturer, donnees_z, pdf_temporaire
 import csv
-from django.db.models import Sum, Q
-from django.db.models.functions import TruncDay, TruncWeek, TruncMonth, TruncYear
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from io import BytesIO
-import base64
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
 from django.contrib import messages
 from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, urlencode
+from django.urls import reverse
 from django.views.decorators.csrf import csrf_exempt
-from datetime import datetime
-import xlsxwriter
-from io import BytesIO
-
-MODES_PAIEMENT = [
-    ('especes', 'Espèces'),
-    ('carte', 'Carte'),
-    ('cheque', 'Chèque'),
-    ('ticket', 'Ticket Restaurant'),
-]
+from django.views.decorators.http import require_POST
+from datetime import date, datetime
 
 def accueil(request):
     return render(request, 'caisse/accueil.html')
 
 def importer_produits(request):
     if request.method == 'POST':
-        csv_file = request.FILES['csv_file']
-        decoded_file = csv_file.read().decode('utf-8').splitlines()
-        reader = csv.DictReader(decoded_file)
-        for row in reader:
-            try:
-                prix = Decimal(row['prix'])
-                stock = int(row['stock'])
-                Produit.objects.create(nom=row['nom'], prix=prix, stock=stock)
-            except (InvalidOperation, ValueError):
-                messages.error(request, f"Ligne invalide ignorée: {row}")
-                continue
-        messages.success(request, "Produits importés avec succès")
-        return redirect('accueil')
+        csv_file = request.FILES.get('csv_file')
+        if not csv_file:
+            messages.error(request, "Aucun fichier CSV fourni")
+            return redirect('importer_produits')
+        try:
+            rapport = importer_csv(csv_file)
+        except (UnicodeDecodeError, csv.Error) as e:
+            messages.error(request, f"Fichier CSV illisible: {e}")
+            return redirect('importer_produits')
+        messages.success(request, f"Import terminé : {rapport['crees']} produits créés, {rapport['mis_a_jour']} mis à jour, {len(rapport['erreurs'])} lignes ignorées")
+        return render(request, 'caisse/importer_produits.html', {'rapport': rapport})
     return render(request, 'caisse/importer_produits.html')
 
-def rapports(request):
+def filtrer_paiements(request):
     date_debut = request.GET.get('date_debut')
     date_fin = request.GET.get('date_fin')
-    export_excel = request.GET.get('export_excel') == '1'
-
-    filters = Q()
+    debut = fin = None
     if date_debut:
         try:
             debut = datetime.strptime(date_debut, '%Y-%m-%d').date()
-            filters &= Q(date_paiement__date__gte=debut)
         except ValueError:
             pass
     if date_fin:
         try:
             fin = datetime.strptime(date_fin, '%Y-%m-%d').date()
-            filters &= Q(date_paiement__date__lte=fin)
         except ValueError:
             pass
+    return date_debut, date_fin, debut, fin, paiements_entre(debut, fin)
 
-    paiements = Paiement.objects.filter(filters)
-
-    ca_jour = paiements.annotate(date=TruncDay('date_paiement')).values('date').annotate(total=Sum('montant_paye')).order_by('date')
-    ca_semaine = paiements.annotate(semaine=TruncWeek('date_paiement')).values('semaine').annotate(total=Sum('montant_paye')).order_by('semaine')
-    ca_mois = paiements.annotate(mois=TruncMonth('date_paiement')).values('mois').annotate(total=Sum('montant_paye')).order_by('mois')
-    ca_an = paiements.annotate(an=TruncYear('date_paiement')).values('an').annotate(total=Sum('montant_paye')).order_by('an')
-
-    details_jour = []
-    for jour in ca_jour:
-        date_j = jour['date']
-        modes_details = Paiement.objects.filter(date_paiement__date=date_j).values('mode').annotate(montant=Sum('montant_paye'))
-        detail_modes = {mode['mode']: mode['montant'] for mode in modes_details}
-        detail_modes['total'] = jour['total']
-        detail_modes['date'] = date_j
-        details_jour.append(detail_modes)
+def rapports(request):
+    date_debut, date_fin, debut, fin, paiements = filtrer_paiements(request)
+    export_excel = request.GET.get('export_excel') == '1'
 
-    ventes_list = Vente.objects.filter(paiements__in=paiements).distinct().order_by('-date_vente')
-    paiements_list = paiements.order_by('-date_paiement')
-    today = timezone.now().date()
-    daily_total = paiements.filter(date_paiement__date=today).aggregate(total=Sum('montant_paye'))['total'] or Decimal('0')
+    agregats = agreger_jours(ca_par_jour_cumule(debut, fin))
+    today = timezone.localdate()
+    daily_total = total_du_jour(agregats, today)
 
     if export_excel:
-        output = BytesIO()
-        workbook = xlsxwriter.Workbook(output, {'remove_timezone': True})
-        worksheet = workbook.add_worksheet('Rapports')
+        # Préparé par le worker traiter_exports : la requête ne construit pas le classeur
+        export = demander_export(debut, fin)
+        if export.statut == 'termine':
+            return redirect('export_fichier', export_id=export.id)
+        messages.info(request, "Export Excel en préparation, le téléchargement démarrera automatiquement")
+        return redirect(f"{reverse('rapports')}?{urlencode({'date_debut': date_debut or '', 'date_fin': date_fin or '', 'export': export.id})}")
 
-        header_format = workbook.add_format({'bold': True, 'bg_color': '#D3D3D3', 'border': 1})
-        total_format = workbook.add_format({'bold': True, 'bg_color': '#90EE90'})
-        money_format = workbook.add_format({'num_format': '#,##0.00 €', 'border': 1})
-        date_format = workbook.add_format({'num_format': 'dd/mm/yyyy', 'border': 1})
+    tickets = tickets_entre(debut, fin)
+    tickets_page, tickets_suivant = page_keyset(tickets, 'date_ticket')
+    ventes_page, ventes_suivant = page_keyset(ventes_entre(debut, fin), 'date_vente')
+    paiements_page, paiements_suivant = page_keyset(paiements, 'date_paiement')
+    # Identifiant d'export passé dans l'URL : ignoré s'il n'est pas un entier positif
+    try:
+        export_id = int(request.GET.get('export', ''))
+    except ValueError:
+        export_id = None
+    context = {
+        'ca_jour': agregats['jours'],
+        'ca_semaine': agregats['semaines'],
+        'ca_mois': agregats['mois'],
+        'ca_an': agregats['annees'],
+        'stats_tickets': stats_tickets(tickets),
+        'tickets_list': tickets_page,
+        'tickets_suivant': tickets_suivant,
+        'ventes_list': ventes_page,
+        'ventes_suivant': ventes_suivant,
+        'paiements_list': paiements_page,
+        'paiements_suivant': paiements_suivant,
+        'daily_total': daily_total,
+        'periodes_graphique': [('jour', 'Jour'), ('semaine', 'Semaine'), ('mois', 'Mois'), ('an', 'Année')],
+        'date_debut': date_debut,
+        'date_fin': date_fin,
+        'export_id': export_id if export_id and export_id > 0 else None,
+        'aujourd_hui': today,
+    }
+    return render(request, 'caisse/rapports.html', context)
 
-        row = 0
-        worksheet.write(row, 0, 'Période', header_format)
-        worksheet.write(row, 1, date_debut or 'Début', date_format)
-        worksheet.write(row, 2, date_fin or 'Fin', date_format)
-        row += 2
+def export_statut(request, export_id):
+    export = get_object_or_404(ExportRapport, id=export_id)
+    return JsonResponse({
+        'id': export.id,
+        'statut': export.statut,
+        'progression': export.progression,
+        'erreur': export.erreur,
+        'fichier': reverse('export_fichier', args=[export.id]) if export.statut == 'termine' else None,
+    })
 
-        worksheet.write(row, 0, 'CA par Jour', header_format)
-        row += 1
-        headers = ['Date', 'Espèces', 'Carte', 'Chèque', 'Ticket', 'Total']
-        for col, header in enumerate(headers):
-            worksheet.write(row, col, header, header_format)
-        row += 1
-        for detail in details_jour:
-            worksheet.write(row, 0, detail['date'], date_format)
-            worksheet.write(row, 1, detail.get('especes', 0), money_format)
-            worksheet.write(row, 2, detail.get('carte', 0), money_format)
-            worksheet.write(row, 3, detail.get('cheque', 0), money_format)
-            worksheet.write(row, 4, detail.get('ticket', 0), money_format)
-            worksheet.write(row, 5, detail['total'], total_format)
-            row += 1
-        row += 2
+def export_fichier(request, export_id):
+    export = get_object_or_404(ExportRapport, id=export_id, statut='termine')
+    nom = f"rapports_caisse_{export.date_debut or 'debut'}_{export.date_fin or 'fin'}.{export.format}"
+    return FileResponse(export.fichier.open('rb'), as_attachment=True, filename=nom, content_type=CONTENT_TYPE_XLSX)
 
-        worksheet.write(row, 0, 'CA par Semaine', header_format)
-        row += 1
-        worksheet.write(row, 0, 'Semaine', header_format)
-        worksheet.write(row, 1, 'Total', header_format)
-        row += 1
-        for item in ca_semaine:
-            worksheet.write(row, 0, str(item['semaine']), date_format)
-            worksheet.write(row, 1, item['total'], money_format)
-            row += 1
-        row += 2
+def rapport_z(request, jour):
+    try:
+        jour = date.fromisoformat(jour)
+    except ValueError:
+        raise Http404("Date invalide")
+    nom = f"rapport_z_{jour.isoformat()}.pdf"
+    cloture = ClotureJournee.objects.filter(jour=jour).first()
+    if cloture is not None:
+        # Journée clôturée : le PDF archivé, sans aucun recalcul
+        return FileResponse(cloture.pdf.open('rb'), filename=nom, content_type='application/pdf')
+    fichier = pdf_temporaire(donnees_z(jour), provisoire=True)
+    return FileResponse(fichier, filename=nom, content_type='application/pdf')
 
-        worksheet.write(row, 0, 'CA par Mois', header_format)
-        row += 1
-        worksheet.write(row, 0, 'Mois', header_format)
-        worksheet.write(row, 1, 'Total', header_format)
-        row += 1
-        for item in ca_mois:
-            worksheet.write(row, 0, str(item['mois']), date_format)
-            worksheet.write(row, 1, item['total'], money_format)
-            row += 1
-        row += 2
+@require_POST
+def cloturer_journee(request):
+    try:
+        jour = date.fromisoformat(request.POST.get('jour', ''))
+    except ValueError:
+        messages.error(request, "Date invalide")
+        return redirect('rapports')
+    try:
+        cloturer(jour, request.user if request.user.is_authenticated else None)
+    except ValueError as e:
+        messages.error(request, str(e))
+        return redirect('rapports')
+    messages.success(request, f"Journée du {jour} clôturée")
+    return redirect('rapport_z', jour=jour.isoformat())
 
-        worksheet.write(row, 0, 'CA par Année', header_format)
-        row += 1
-        worksheet.write(row, 0, 'Année', header_format)
-        worksheet.write(row, 1, 'Total', header_format)
-        row += 1
-        for item in ca_an:
-            worksheet.write(row, 0, str(item['an']), date_format)
-            worksheet.write(row, 1, item['total'], money_format)
-            row += 1
-        row += 2
+def rapports_graphique(request):
+    debut, fin = filtrer_paiements(request)[2:4]
+    periode = request.GET.get('periode', 'jour')
+    if periode not in PERIODES:
+        periode = 'jour'
+    png, etag, genere_le = graphique_ca(periode, debut, fin)
+    response = HttpResponse(png, content_type='image/png')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(genere_le)
+    response['Cache-Control'] = 'private, no-cache'
+    return get_conditional_response(request, etag=etag, last_modified=genere_le, response=response)
 
-        worksheet.write(row, 0, 'Ventes Détaillées', header_format)
-        row += 1
-        headers = ['Produit', 'Quantité', 'Total', 'Date']
-        for col, header in enumerate(headers):
-            worksheet.write(row, col, header, header_format)
-        row += 1
-        for vente in ventes_list:
-            worksheet.write(row, 0, vente.produit.nom)
-            worksheet.write(row, 1, vente.quantite)
-            worksheet.write(row, 2, vente.total, money_format)
-            worksheet.write(row, 3, vente.date_vente, date_format)
-            row += 1
-        row += 2
+def rapports_tickets(request):
+    debut, fin = filtrer_paiements(request)[2:4]
+    tickets, suivant = page_keyset(tickets_entre(debut, fin), 'date_ticket', request.GET.get('apres'))
+    html = render_to_string('caisse/rapports_tickets.html', {'tickets_list': tickets}, request=request)
+    return JsonResponse({'html': html, 'suivant': suivant})
 
-        worksheet.write(row, 0, 'Paiements Détaillés', header_format)
-        row += 1
-        headers = ['Mode', 'Montant', 'Date']
-        for col, header in enumerate(headers):
-            worksheet.write(row, col, header, header_format)
-        row += 1
-        for paiement in paiements_list:
-            worksheet.write(row, 0, paiement.get_mode_display())
-            worksheet.write(row, 1, paiement.montant_paye, money_format)
-            worksheet.write(row, 2, paiement.date_paiement, date_format)
-            row += 1
+def ticket(request, ticket_id):
+    """Réimpression d'un ticket : l'en-tête et ses lignes, paiements et remises."""
+    ticket = get_object_or_404(
+        Ticket.objects.prefetch_related(
+            Prefetch('lignes', queryset=Vente.objects.select_related('produit').order_by('id')),
+            Prefetch('paiements', queryset=Paiement.objects.order_by('id')),
+            Prefetch('remises', queryset=Remise.objects.select_related('appliquee_a_produit').order_by('id')),
+        ),
+        id=ticket_id,
+    )
+    return render(request, 'caisse/ticket.html', {'ticket': ticket})
 
-        workbook.close()
-        output.seek(0)
-        response = HttpResponse(output.read(), content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename=rapports_caisse.xlsx'
-        return response
+def rapports_ventes(request):
+    debut, fin = filtrer_paiements(request)[2:4]
+    ventes, suivant = page_keyset(ventes_entre(debut, fin), 'date_vente', request.GET.get('apres'))
+    html = render_to_string('caisse/rapports_ventes.html', {'ventes_list': ventes}, request=request)
+    return JsonResponse({'html': html, 'suivant': suivant})
 
-    context = {
-        'ca_jour': details_jour,
-        'ca_semaine': ca_semaine,
-        'ca_mois': ca_mois,
-        'ca_an': ca_an,
-        'ventes_list': ventes_list,
-        'paiements_list': paiements_list,
-        'daily_total': daily_total,
-        'date_debut': date_debut,
-        'date_fin': date_fin,
-    }
-    return render(request, 'caisse/rapports.html', context)
+def rapports_paiements(request):
+    paiements = filtrer_paiements(request)[-1]
+    paiements, suivant = page_keyset(paiements, 'date_paiement', request.GET.get('apres'))
+    html = render_to_string('caisse/rapports_paiements.html', {'paiements_list': paiements}, request=request)
+    return JsonResponse({'html': html, 'suivant': suivant})
 
 def produits_critiques(request):
-    SEUIL_CRITIQUE = 5
-    produits_critiques = Produit.objects.filter(stock__lte=SEUIL_CRITIQUE)
-    context = {'produits_critiques': produits_critiques, 'seuil': SEUIL_CRITIQUE}
+    # Seuil propre à chaque produit, calculé depuis sa vitesse de vente (commande calculer_previsions)
+    context = {'produits_critiques': a_reassortir(), 'seuil_defaut': SEUIL_DEFAUT}
     return render(request, 'caisse/produits_critiques.html', context)
 
 def reassort_produit(request, produit_id):
@@ -208,8 +203,6 @@ def reassort_produit(request, produit_id):
         try:
             quantite = int(request.POST['quantite'])
             if quantite > 0:
-                produit.stock += quantite
-                produit.save()
                 Reassort.objects.create(produit=produit, quantite_ajoutee=quantite)
                 messages.success(request, f"Réassort de {quantite} unités pour {produit.nom}")
             else:
@@ -220,88 +213,32 @@ def reassort_produit(request, produit_id):
     return render(request, 'caisse/reassort_form.html', {'produit': produit})
 
 def reassort_auto(request):
-    SEUIL_MIN = 5
-    STOCK_CIBLE = 20
-    produits = Produit.objects.filter(stock__lte=SEUIL_MIN)
-    reassortés = []
-    for produit in produits:
-        a_ajouter = STOCK_CIBLE - produit.stock
-        if a_ajouter > 0:
-            produit.stock += a_ajouter
-            produit.save()
-            Reassort.objects.create(produit=produit, quantite_ajoutee=a_ajouter)
-            reassortés.append(produit)
+    utilisateur = request.user if request.user.is_authenticated else None
+    reassortés = reassort_previsionnel(utilisateur)
     messages.success(request, f"Réassort auto effectué sur {len(reassortés)} produits")
     return redirect('produits_critiques')
 
-def get_panier_dict(request):
-    panier = request.session.get('panier', {})
-    if not isinstance(panier, dict):
-        panier = {}
-    cleaned_panier = {str(key): int(value) for key, value in panier.items() if isinstance(value, (int, str)) and int(value) > 0}
-    request.session['panier'] = cleaned_panier
-    request.session.modified = True
-    return cleaned_panier
-
-def get_panier_ventes(panier_dict):
-    ventes = []
-    for str_id, quantite in panier_dict.items():
-        try:
-            produit_id = int(str_id)
-            produit = Produit.objects.get(id=produit_id)
-            subtotal = produit.prix * quantite
-            ventes.append({'produit': produit, 'quantite': quantite, 'total': subtotal})
-        except (ValueError, Produit.DoesNotExist):
-            pass
-    return ventes
-
-def calculer_total_panier(request):
-    panier = get_panier_dict(request)
-    total = Decimal('0')
-    for str_id, quantite in panier.items():
-        try:
-            produit_id = int(str_id)
-            produit = Produit.objects.get(id=produit_id)
-            subtotal = produit.prix * quantite
-            remises_article = Remise.objects.filter(appliquee_a_produit=produit, appliquee_a_vente__isnull=True)
-            for remise in remises_article:
-                deduction = remise.appliquer(subtotal)
-                subtotal = max(Decimal('0'), subtotal - deduction)
-            total += subtotal
-        except (ValueError, Produit.DoesNotExist):
-            pass
-    remises_globales = Remise.objects.filter(appliquee_a_produit__isnull=True, appliquee_a_vente__isnull=True)
-    for remise in remises_globales:
-        deduction = remise.appliquer(total)
-        total = max(Decimal('0'), total - deduction)
-    return total
-
 @csrf_exempt
 def caisse(request):
-    produits = Produit.objects.all()
     panier = get_panier_dict(request)
-    total = calculer_total_panier(request)
-    panier_ventes = get_panier_ventes(panier)
+    prix = prix_panier(request, panier)
+    total = total_panier(prix)
+    panier_ventes = lignes_panier(prix)
     form = VenteForm()
     
     if request.method == 'POST':
-        request.session.modified = True
-        
         if 'produit' in request.POST:
             try:
                 produit_id = int(request.POST['produit'])
                 str_id = str(produit_id)
                 produit = get_object_or_404(Produit, id=produit_id)
-                if produit.stock >= 1:
+                if retirer_stock(produit.id):
                     panier[str_id] = panier.get(str_id, 0) + 1
-                    request.session['panier'] = panier
-                    produit.stock -= 1
-                    produit.save()
-                    new_total = calculer_total_panier(request)
-                    new_panier_ventes = get_panier_ventes(panier)
-                    new_panier_html = render_to_string('caisse/panier_list.html', {'panier_ventes': new_panier_ventes}, request=request)
+                    enregistrer_panier(request, panier)
+                    prix = maj_ligne(request, panier, str_id, produit)
                     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-                        return JsonResponse({'success': True, 'total': str(new_total), 'panier_html': new_panier_html})
+                        new_panier_html = render_to_string('caisse/panier_list.html', {'panier_ventes': lignes_panier(prix)}, request=request)
+                        return JsonResponse({'success': True, 'total': prix['total'], 'panier_html': new_panier_html})
                     messages.success(request, f"{produit.nom} ajouté au panier")
                 else:
                     error = 'Stock insuffisant pour cet article'
@@ -313,19 +250,29 @@ def caisse(request):
             return redirect('caisse')
                 
         elif 'ajouter_nouveau' in request.POST:
-            nom = request.POST.get('nom', '').strip()
-            prix_str = request.POST.get('prix', '0')
-            stock_str = request.POST.get('stock', '0')
+            # Mêmes règles qu'à l'import CSV (code-barres EAN compris)
             try:
-                prix = Decimal(prix_str)
-                stock = int(stock_str)
-                if nom and prix > 0 and stock >= 0:
-                    Produit.objects.create(nom=nom, prix=prix, stock=stock)
-                    messages.success(request, f"Produit {nom} ajouté avec succès")
-                else:
-                    messages.error(request, "Données invalides pour le nouveau produit")
-            except (ValueError, InvalidOperation):
-                messages.error(request, "Prix ou stock invalide")
+                valeurs = valider_ligne({
+                    'nom': request.POST.get('nom', ''),
+                    'code_barre': request.POST.get('code_barre', ''),
+                    'prix': request.POST.get('prix', '0'),
+                    'stock': request.POST.get('stock', '0'),
+                })
+            except ValueError as e:
+                messages.error(request, f"Données invalides pour le nouveau produit : {e}")
+                return redirect('caisse')
+            if valeurs['prix'] <= 0:
+                messages.error(request, "Données invalides pour le nouveau produit : prix nul")
+                return redirect('caisse')
+            try:
+                with transaction.atomic():
+                    produit = Produit.objects.create(**valeurs)
+                    tracer([(produit.id, 'ajustement', produit.stock)])
+            except IntegrityError:
+                # Index unique : un autre poste vient d'enregistrer ce code-barres
+                messages.error(request, f"Code-barres {valeurs['code_barre']} déjà utilisé")
+            else:
+                messages.success(request, f"Produit {produit.nom} ajouté avec succès")
             return redirect('caisse')
                 
         elif 'supprimer_produit' in request.POST:
@@ -344,7 +291,7 @@ def caisse(request):
             try:
                 valeur = Decimal(valeur_str)
                 if valeur > 0 and (type_remise == 'pourcentage' and valeur <= 100 or type_remise == 'fixe'):
-                    Remise.objects.create(type=type_remise, valeur=valeur)
+                    ajouter_remise(request, panier, type_remise, valeur)
                     messages.success(request, "Remise globale appliquée avec succès")
                 else:
                     messages.error(request, "Valeur de remise invalide")
@@ -357,13 +304,12 @@ def caisse(request):
                 index = int(request.POST['appliquer_remise_article'])
                 if 0 <= index < len(panier_ventes):
                     item = panier_ventes[index]
-                    produit = item['produit']
                     type_remise = request.POST.get('type_remise', 'pourcentage')
                     valeur_str = request.POST.get('valeur_remise', '0')
                     valeur = Decimal(valeur_str)
                     if valeur > 0 and (type_remise == 'pourcentage' and valeur <= 100 or type_remise == 'fixe'):
-                        Remise.objects.create(type=type_remise, valeur=valeur, appliquee_a_produit=produit)
-                        messages.success(request, f"Remise appliquée sur {produit.nom}")
+                        ajouter_remise(request, panier, type_remise, valeur, str(item['produit_id']))
+                        messages.success(request, f"Remise appliquée sur {item['nom']}")
                     else:
                         messages.error(request, "Valeur de remise invalide")
                 else:
@@ -377,16 +323,15 @@ def caisse(request):
                 index = int(request.POST['remove_item'])
                 if 0 <= index < len(panier_ventes):
                     item = panier_ventes[index]
-                    produit_id = item['produit'].id
+                    produit_id = item['produit_id']
                     str_id = str(produit_id)
                     if str_id in panier:
                         panier[str_id] -= 1
-                        produit = item['produit']
-                        produit.stock += 1
-                        produit.save()
+                        remettre_stock(produit_id)
                         if panier[str_id] <= 0:
                             del panier[str_id]
-                        request.session['panier'] = panier
+                        enregistrer_panier(request, panier)
+                        maj_ligne(request, panier, str_id)
                         messages.success(request, "Article retiré du panier")
                 else:
                     messages.error(request, "Article invalide")
@@ -395,15 +340,9 @@ def caisse(request):
             return redirect('caisse')
                 
         elif 'vider_panier' in request.POST:
-            for str_id, quantite in list(panier.items()):
-                try:
-                    produit_id = int(str_id)
-                    produit = Produit.objects.get(id=produit_id)
-                    produit.stock += quantite
-                    produit.save()
-                except (ValueError, Produit.DoesNotExist):
-                    pass
-            request.session['panier'] = {}
+            remettre_stocks({str_id: quantite for str_id, quantite in panier.items() if str_id.isdigit()})
+            enregistrer_panier(request, {})
+            vider(request)
             messages.success(request, "Panier vidé et stocks restaurés")
             return redirect('caisse')
         
@@ -422,45 +361,20 @@ def caisse(request):
                 except InvalidOperation:
                     pass
                 i += 1
-            sum_montants = sum(montants)
-            if abs(sum_montants - total) < Decimal('0.01') and panier and modes:
-                ventes_crees = []
-                for str_id, quantite in list(panier.items()):
-                    try:
-                        produit_id = int(str_id)
-                        produit = Produit.objects.get(id=produit_id)
-                        subtotal_brut = produit.prix * quantite
-                        remises_article = Remise.objects.filter(appliquee_a_produit=produit, appliquee_a_vente__isnull=True)
-                        subtotal = subtotal_brut
-                        for remise in remises_article:
-                            deduction = remise.appliquer(subtotal)
-                            subtotal = max(Decimal('0'), subtotal - deduction)
-                        vente = Vente.objects.create(produit=produit, quantite=quantite, total=subtotal)
-                        ventes_crees.append(vente)
-                        for remise in remises_article:
-                            remise.appliquee_a_vente = vente
-                            remise.save()
-                    except (ValueError, Produit.DoesNotExist):
-                        pass
-                remises_globales = Remise.objects.filter(appliquee_a_produit__isnull=True, appliquee_a_vente__isnull=True)
-                for remise in remises_globales:
-                    if ventes_crees:
-                        remise.appliquee_a_vente = ventes_crees[0]
-                        remise.save()
-                if ventes_crees:
-                    for j, mode in enumerate(modes):
-                        Paiement.objects.create(vente=ventes_crees[-1], mode=mode, montant_paye=montants[j])
-                    messages.success(request, f"Paiement enregistré ! Total: {total} €")
-                else:
-                    messages.error(request, "Erreur lors de la création des ventes")
-                request.session['panier'] = {}
-                Remise.objects.filter(appliquee_a_vente__isnull=True).delete()
+            try:
+                total, ventes, _ = encaisser(panier, list(zip(modes, montants)))
+            except ValueError as e:
+                messages.error(request, str(e))
             else:
-                messages.error(request, f"Montant payé {sum_montants} ≠ total {total} ou panier vide ou modes manquants")
+                enregistrer_panier(request, {})
+                vider(request)
+                messages.success(request, f"Paiement enregistré ! Total: {total} € (ticket n° {ventes[0].ticket_id})")
             return redirect('caisse')
         
     context = {
-        'produits': produits,
+        'catalogue_html': grille_catalogue(),
+        'seuil_alerte': SEUIL_ALERTE,
+        'limite_stocks': LIMITE_STOCKS,
         'form': form,
         'panier_ventes': panier_ventes,
         'total': total,